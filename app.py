@@ -2,162 +2,333 @@ from flask import (
     Flask,
     render_template,
     request,
-    send_from_directory,
-    redirect
+    redirect,
+    stream_template,
+    jsonify,
+    abort,
+    Response,
+    url_for,
+    g
 )
-import xml.etree.ElementTree as ET
 import os
-import codecs
-import xml.dom.minidom
+import math
+import time
+import atexit
+import bisect
+import json
+import tarfile
+import zipfile
+import xml.etree.ElementTree as ET
 from werkzeug.utils import secure_filename
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, SelectField, SelectMultipleField
-from wtforms.validators import InputRequired
+import click
+
+from bulk_import import import_records
+from dedup import DuplicateIndex
+from export import EXPORT_FORMATS
+from facets import FacetIndex, default_extractors
+from http_cache import COMPRESSIBLE_MIMETYPES, CompressedCache, compress, negotiate_encoding, representation_etag
+from metrics import Metrics, RequestProfiler
+from record_cache import RecordCache
+from record_store import SqliteStore
+from search_index import SearchIndex
+from site_schema import (
+    AGE_CHOICES,
+    CATEGORY_CHOICES,
+    DATING_CRITERIA_CHOICES,
+    LANGUAGE_CHOICES,
+    LANGUAGE_CODES,
+    form_class,
+    parse_form,
+    site_object_of,
+    validate_site_values
+)
+from site_xml import build_site_xml, parse_site_object
+from spatial_index import SpatialIndex, parse_coordinate, site_points
+from storage import content_digest, file_lock
+from upload_folder import MANIFEST_NAME, FlatFolder, ShardedFolder, valid_name
+from watcher import FolderWatcher
+from write_queue import WriteBehindQueue
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 app.secret_key = os.urandom(24)
 
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['CACHE_FOLDER'] = 'cache'
+app.config['LOCK_FOLDER'] = os.path.join(app.config['CACHE_FOLDER'], 'locks')
+app.config['UPLOADS_PAGE_SIZE'] = 50
+app.config['BULK_IMPORT_WORKERS'] = None  # process pool size, None for one per CPU, 0 to import in-process
+app.config['BULK_IMPORT_BATCH_SIZE'] = 256
+app.config['API_REFRESH_INTERVAL'] = 5  # seconds between upload folder scans for /api requests
+# WRITE_BEHIND=1 makes /submit journal the record and return; a background
+# thread writes it out (see write_queue.py and /api/write-queue).
+app.config['WRITE_BEHIND'] = os.environ.get('WRITE_BEHIND') == '1'
+app.config['WRITE_BEHIND_BATCH_SIZE'] = 64
+app.config['JOURNAL_FOLDER'] = os.path.join(app.config['CACHE_FOLDER'], 'journal')
+# WATCH_UPLOADS=1 follows changes to UPLOAD_FOLDER made outside the app
+# (rsync, manual edits) instead of rescanning the folder on requests.
+app.config['WATCH_UPLOADS'] = os.environ.get('WATCH_UPLOADS') == '1'
+app.config['WATCH_DEBOUNCE_SECONDS'] = 0.25
+app.config['WATCH_POLL_INTERVAL'] = 5  # seconds between folder sweeps where inotify is unavailable
+app.config['COMPRESS_MIN_SIZE'] = 1024  # smaller responses are sent uncompressed
+app.config['COMPRESSED_CACHE_BYTES'] = 32 * 1024 * 1024  # pre-compressed XML downloads kept in memory
 
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+# 'flat' keeps every file directly in UPLOAD_FOLDER; 'sharded' keeps them in
+# hash-prefix subfolders listed in a manifest (see upload_folder.py and the
+# migrate-to-sharded command). A folder with a manifest is sharded.
+app.config['UPLOAD_LAYOUT'] = os.environ.get('UPLOAD_LAYOUT') or (
+    'sharded' if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], MANIFEST_NAME)) else 'flat'
+)
+# Least seconds between checks of the shard folders for files changed outside the app.
+app.config['SHARD_CHECK_INTERVAL'] = 30
+
+# 'files' reads records straight from the XML files in UPLOAD_FOLDER;
+# 'sqlite' keeps them in SQLITE_DATABASE and treats the files as an export
+# format (see the migrate-to-sqlite and export-xml commands).
+app.config['RECORD_STORE'] = os.environ.get('RECORD_STORE', 'files')
+app.config['SQLITE_DATABASE'] = 'records.sqlite3'
+# Least seconds between rewrites of cache/records.json after changes; it is also written at exit.
+app.config['CACHE_SAVE_INTERVAL'] = 60
+
+# Opt-in instrumentation: METRICS=1 exposes /metrics, PROFILE_SAMPLE_RATE=0.01
+# profiles 1% of requests and keeps those slower than PROFILE_SLOW_SECONDS.
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS') == '1'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_SLOW_SECONDS'] = float(os.environ.get('PROFILE_SLOW_SECONDS', 1.0))
+app.config['PROFILE_FOLDER'] = os.path.join(app.config['CACHE_FOLDER'], 'profiles')
+
+metrics = Metrics(enabled=app.config['METRICS_ENABLED'])
+metrics.describe('digitalsee_requests_total', 'counter', 'Requests by endpoint and status code.')
+metrics.describe('digitalsee_request_seconds', 'histogram', 'Request handling time by endpoint.')
+metrics.describe('digitalsee_phase_seconds', 'histogram', 'Time spent in each phase of submit and view_uploads.')
+metrics.describe('digitalsee_errors_total', 'counter', 'Unhandled exceptions caught by a handler.')
+metrics.describe('digitalsee_profiles_total', 'counter', 'Slow request profiles written.')
+metrics.describe('digitalsee_records', 'gauge', 'Records known to this worker.')
+metrics.describe('digitalsee_write_queue_pending', 'gauge', 'Submissions journaled but not yet written.')
+profiler = RequestProfiler(
+    app.config['PROFILE_SAMPLE_RATE'],
+    app.config['PROFILE_SLOW_SECONDS'],
+    app.config['PROFILE_FOLDER']
+)
+
+compressed_xml = CompressedCache(app.config['COMPRESSED_CACHE_BYTES'])
+
+# Part of the listing ETag, so a deploy that changes the page does not answer 304 with stale HTML.
+with open(os.path.join(app.root_path, 'templates', 'view_uploads.html'), 'rb') as template_file:
+    LISTING_TEMPLATE_DIGEST = content_digest(template_file.read())
+
+if app.config['UPLOAD_LAYOUT'] == 'sharded':
+    upload_folder = ShardedFolder(
+        app.config['UPLOAD_FOLDER'],
+        app.config['LOCK_FOLDER'],
+        check_interval=app.config['SHARD_CHECK_INTERVAL']
+    )
+else:
+    upload_folder = FlatFolder(app.config['UPLOAD_FOLDER'])
+
+if app.config['RECORD_STORE'] == 'sqlite':
+    store = SqliteStore(app.config['SQLITE_DATABASE'])
+else:
+    store = RecordCache(
+        upload_folder,
+        os.path.join(app.config['CACHE_FOLDER'], 'records.json'),
+        save_interval=app.config['CACHE_SAVE_INTERVAL']
+    )
+    atexit.register(store.save)
+if metrics.enabled and isinstance(store, RecordCache):
+    store.observe_phase = lambda phase, seconds: metrics.observe(
+        'digitalsee_phase_seconds', seconds, route='view_uploads', phase=phase
+    )
+
+search_index = SearchIndex()
+store.subscribe(search_index.update)
+spatial_index = SpatialIndex()
+store.subscribe(spatial_index.update)
+duplicate_index = DuplicateIndex(spatial_index)
+store.subscribe(duplicate_index.update)
+
 ALLOWED_EXTENSIONS = {'xml'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-class MyForm(FlaskForm):
-    # Common Fields
-    required_string_field = lambda label: StringField(label, validators=[InputRequired()])
-    optional_string_field = lambda label: StringField(label)
-    select_field = lambda label, choices: SelectField(label, choices=choices)
-    
-    # Reusable Choice Lists
-    dating_criteria_choices = [
-        ('', '--Please select from the list--'),
-        ('lettering', 'Paleography of the document'),
-        ('nomenclature', 'Personal names and naming conventions for a specific period'),
-        ('prosopography', 'Mention of historically attested individuals'),
-        ('reign', 'Mention of officials with known periods of rule'),
-        ('titulature', 'Mention of imperial or other titles with known dates'),
-        ('internal-date', 'Explicit dating in the document'),
-        ('context', 'Archaeological or architectural context'),
-    ]
-    
-    age_choices = [
-        ('', '--Please select from the list--'),
-        ('prehistory', 'Prehistory'),
-        ('iron_age', 'Iron Age'),
-        ('roman_age', 'Roman Age'),
-        ('late_antiquity', 'Late Antiquity'),
-        ('middle_ages', 'Middle Ages'),
-        ('ottoman_period', 'Ottoman Period'),
-    ]
-    
-    certainty_choices = [
-        ('', '--Please select from the list--'),
-        ('high', 'High certainty'),
-        ('medium', 'Relative certainty'),
-        ('low', 'Low certainty'),
-    ]
-    
-    language_choices = [
-        ('', '--Please select from the list--'),
-        ('eng', 'English'), ('ara', 'Arabic'), ('bos', 'Bosnian'), ('bul', 'Bulgarian'), 
-        ('ell', 'Modern Greek'), ('spa', 'Spanish'), ('ita', 'Italian'), ('lat', 'Latin'), 
-        ('deu', 'German'), ('ota', 'Ottoman Turkish'), ('fas', 'Persian'), ('pol', 'Polish'), 
-        ('ron', 'Romanian'), ('rus', 'Russian'), ('srp', 'Serbian'), ('grc', 'Ancient Greek'), 
-        ('tur', 'Turkish'), ('hun', 'Hungarian'), ('fre', 'French'), ('hrv', 'Croatian'), 
-        ('chu', 'Church Slavonic')
-    ]
-
-    # Main Form Fields
-    filename = required_string_field('Filename')
-    author = required_string_field('Author')
-    name_source = required_string_field('Name (according to source)')
-    name_contemporary = required_string_field('Name (contemporary)')
-    description = TextAreaField('Description')
-    provenance_origin = optional_string_field('Provenance Origin')
-    latitude = required_string_field('Latitude')
-    longitude = required_string_field('Longitude')
-    geonamesLink = optional_string_field('Geonames Link')
-    pleiadesLink = optional_string_field('Pleiades Link')
-    date = required_string_field('Date')
-    datingCriteria = select_field('Dating Criteria', dating_criteria_choices)
-    localizationSource = optional_string_field('Localization Certainty')
-    localizationCertainty = select_field('Localization Certainty', certainty_choices)
-    age = select_field('Age (according to source)', age_choices)
-    
-    # Observed Data
-    provenanceObservedIn = required_string_field('Provenance Observed In')
-    latitudeObserved = optional_string_field('Latitude Observed')
-    longitudeObserved = optional_string_field('Longitude Observed')
-    geonamesLinkObserved = optional_string_field('Geonames Link Observed')
-    pleiadesLinkObserved = optional_string_field('Pleiades Link Observed')
-    dateObserved = optional_string_field('Date Observed')
-    datingCriteriaObserved = select_field('Dating Criteria Observed', dating_criteria_choices)
-    
-    # Other Locations
-    provenanceOtherLocations = optional_string_field('Provenance Other Locations')
-    latitudeOther = optional_string_field('Latitude Other')
-    longitudeOther = optional_string_field('Longitude Other')
-    geonamesLinkOtherLocations = optional_string_field('Geonames Link Other Locations')
-    dateOtherLocations = optional_string_field('Date Other Locations')
-    datingCriteriaOtherLocations = select_field('Dating Criteria Other Locations', dating_criteria_choices)
-    
-    # Current Location
-    currentLocation = optional_string_field('Current Location')
-    latitudeCurrent = optional_string_field('Latitude Current')
-    longitudeCurrent = optional_string_field('Longitude Current')
-    geonamesLinkCurrent = optional_string_field('Geonames Link Current')
-    pleiadesLinkCurrent = optional_string_field('Pleiades Link Current')
-
-    # Categories and Subcategories
-    categories = SelectMultipleField('Category', choices=[
-        ('communication', 'Communication'), ('religious', 'Religious sites & objects'), ('inscriptions', 'Inscriptions'),
-        ('fortifications', 'Fortifications'), ('settlements', 'Settlements'), ('linear_structures', 'Linear structures'),
-        ('manuscripts', 'Manuscripts'), ('water', 'Water'), ('economy', 'Economy'), ('other', 'Other'), ('burials', 'Burials')
-    ], validators=[InputRequired()])
-    
-    subcategories = {
-        'communication': SelectMultipleField('Communication Subcategories', choices=[
-            ('inn', 'Inn'), ('bridge', 'Bridge'), ('viaduct', 'Viaduct'), ('imaret', 'Imaret'),
-            ('ford', 'Ford'), ('quarantine', 'Quarantine'), ('postStation', 'Post Station'), 
-            ('roadsideFountain', 'Roadside fountain'), ('oldRoadRemains', 'Old Road Remains')
-        ]),
-        'religious': SelectMultipleField('Religious Subcategories', choices=[
-            ('church', 'Church'), ('paganTemple', 'Pagan Temple'), ('chapel', 'Chapel'), 
-            ('mosque', 'Mosque'), ('tekke', 'Tekke'), ('madrasah', 'Madrasah'), ('turbe', 'Türbe'),
-            ('ancientMausoleum', 'Ancient Mausoleum'), ('monastery', 'Monastery'), ('caveMonastery', 'Cave Monastery'),
-            ('votiveTablet', 'Votive Tablet'), ('votiveStone', 'Votive Stone'), ('megaliths', 'Megaliths'), ('synagogue', 'Synagogue')
-        ]),
-        'inscriptions': SelectMultipleField('Inscriptions Subcategories', choices=[
-            ('funerary_inscription', 'Funerary Inscription'), ('boundary_inscription', 'Boundary Inscription'),
-            ('milestone', 'Milestone'), ('building_inscription', 'Building Inscription'), 
-            ('dedicatory_inscription', 'Dedicatory Inscription'), ('honorary_inscription', 'Honorary Inscription'), 
-            ('votive_inscription', 'Votive Inscription'), ('list', 'List'), ('legal_inscription', 'Legal Inscription')
-        ]),
-        # Similar structure for other categories...
-    }
-
-    # Publication and Language Details
-    authorPublication = optional_string_field('Author of Publications (as in Bibliography)')
-    startDate = optional_string_field('Start Date')
-    endDate = optional_string_field('End Date')
-    ageContemporary = select_field('Age (contemporary)', age_choices)
-    originalLanguage = select_field('Original Language', language_choices)
-    publicationLanguage = select_field('Publication Language', language_choices)
-
-    # Additional Information
-    sourceInformation = required_string_field('Source Information/Bibliography')
-    annotation = TextAreaField('Annotations')
-    keywords = required_string_field('Keywords')
-    sourceContent = TextAreaField('Source Content')
-    copyrightStoragePlace = optional_string_field('Copyright Storage Place')
-    viaf = optional_string_field('VIAF')
-    iiif = optional_string_field('IIIF')
+# Form fields, choices and validation all come from the schema in site_schema.py
+MyForm = form_class(FlaskForm)
+
+
+def store_upload(filename, content, overwrite=True):
+    # Write to a temp file and rename it into place while holding the
+    # per-file lock, so concurrent workers never interleave and readers never
+    # see a partially written file. With overwrite=False an existing record
+    # raises FileExistsError instead. Content that is not well-formed XML
+    # raises ValueError in both stores and is not stored.
+    if app.config['RECORD_STORE'] == 'sqlite':
+        if not overwrite and store.get_xml(filename) is not None:
+            raise FileExistsError(filename)
+        # The database holds records, not files: malformed XML is not stored at all.
+        if store.put(filename, content) is None:
+            raise ValueError(f"{filename} is not well-formed XML")
+        return
+    # Otherwise it would be written and then silently left out of the listing.
+    try:
+        parse_site_object(content)
+    except ET.ParseError as e:
+        raise ValueError(f"{filename} is not well-formed XML: {e}")
+    with file_lock(app.config['LOCK_FOLDER'], filename):
+        if not overwrite and upload_folder.exists(filename):
+            raise FileExistsError(filename)
+        upload_folder.write(filename, content)
+        store.put(filename, content)
+
+def upload_exists(filename):
+    if app.config['RECORD_STORE'] == 'sqlite':
+        return store.get_xml(filename) is not None
+    return upload_folder.exists(filename)
+
+def write_submission(filename, values, categories):
+    store_upload(filename, build_site_xml(values, categories).encode('utf-8'))
+
+write_queue = WriteBehindQueue(
+    app.config['JOURNAL_FOLDER'],
+    write_submission,
+    batch_size=app.config['WRITE_BEHIND_BATCH_SIZE']
+)
+if app.config['WRITE_BEHIND']:
+    atexit.register(write_queue.stop)
+
+
+# Facets and the labels of their values, taken from the form vocabularies
+FACET_TITLES = {
+    'category': 'Category',
+    'subcategory': 'Subcategory',
+    'age': 'Age',
+    'dating_criteria': 'Dating Criteria',
+    'language': 'Language',
+}
+FACET_LABELS = {
+    'category': {category: label for category, label, _, _ in CATEGORY_CHOICES},
+    'subcategory': {
+        value: label
+        for _, _, _, subcategories in CATEGORY_CHOICES
+        for value, label in subcategories
+    },
+    'age': dict(AGE_CHOICES),
+    'dating_criteria': dict(DATING_CRITERIA_CHOICES),
+    'language': dict(LANGUAGE_CHOICES),
+}
+
+facet_index = FacetIndex(default_extractors(LANGUAGE_CODES))
+store.subscribe(facet_index.update)
+
+def apply_upload_changes(filenames):
+    # A changed manifest means another worker stored or removed files.
+    if filenames is None or MANIFEST_NAME in filenames:
+        store.refresh()
+    else:
+        store.refresh_files(filenames)
+
+# Only the files store reads UPLOAD_FOLDER; the SQLite store has its own change log.
+upload_watcher = None
+if app.config['WATCH_UPLOADS'] and isinstance(store, RecordCache):
+    upload_watcher = FolderWatcher(
+        app.config['UPLOAD_FOLDER'],
+        apply_upload_changes,
+        debounce=app.config['WATCH_DEBOUNCE_SECONDS'],
+        poll_interval=app.config['WATCH_POLL_INTERVAL'],
+        suffix=('.xml', MANIFEST_NAME),
+        # Only the top level is watched; periodic rescans check the shards.
+        rescan_interval=app.config['SHARD_CHECK_INTERVAL'] if isinstance(upload_folder, ShardedFolder) else None
+    )
+    # Registered after store.save, so it runs before it at exit.
+    atexit.register(upload_watcher.stop)
+
+def refresh_store(max_age=None):
+    """Bring the store up to date, unless the upload watcher already keeps it current."""
+    if upload_watcher is not None and upload_watcher.is_live():
+        return
+    if max_age is None:
+        store.refresh()
+    else:
+        store.refresh_if_stale(max_age)
+
+
+@app.before_request
+def start_write_queue():
+    # Started on the first request rather than at import, so each forked
+    # worker gets its own journal and writer thread.
+    if app.config['WRITE_BEHIND']:
+        write_queue.start()
+
+@app.before_request
+def start_upload_watcher():
+    if upload_watcher is not None:
+        upload_watcher.start()
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled or profiler.sample_rate:
+        g.request_started = time.perf_counter()
+        g.profile = profiler.start()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    profile = g.pop('profile', None)
+
+    def finish():
+        duration = time.perf_counter() - started
+        metrics.inc('digitalsee_requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.observe('digitalsee_request_seconds', duration, endpoint=endpoint)
+        if profile is not None and profiler.stop(profile, endpoint, duration):
+            metrics.inc('digitalsee_profiles_total', endpoint=endpoint)
+
+    if response.is_streamed:
+        # A streamed page is rendered after this hook, while the body is sent.
+        response.call_on_close(finish)
+    else:
+        finish()
+    return response
+
+@app.after_request
+def compress_response(response):
+    # Downloads arrive already compressed; streamed pages are sent as they are rendered.
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None or (response.content_length or 0) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        abort(404)
+    metrics.set('digitalsee_records', len(store.filenames()))
+    if app.config['WRITE_BEHIND']:
+        metrics.set('digitalsee_write_queue_pending', write_queue.status()['pending'])
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/')
@@ -167,262 +338,101 @@ def index():
 @app.route('/submit', methods=['GET', 'POST'])
 def submit():   
     try:
-        author = request.form.get('author')
-        name_source = request.form.get('name_source')
-        name_contemporary = request.form.get('name_contemporary')
-        description = request.form.get('description')
-        provenance_origin = request.form.get('provenance_origin')
-        latitude = request.form.get('latitude')
-        longitude = request.form.get('longitude')
-        geonamesLink = request.form.get('geonamesLink')
-        pleiadesLink = request.form.get('pleiadesLink')
-        date = request.form.get('date')
-        datingCriteria = request.form.get('datingCriteria')
-        localizationSource = request.form.get('localizationSource')
-        localizationCertainity = request.form.get('localizationCertainity')
-        age = request.form.get('age')
-        provenanceObservedIn = request.form.get('provenanceObservedIn')
-        latitudeObserved = request.form.get('latitudeObserved')
-        longitudeObserved = request.form.get('longitudeObserved')
-        geonamesLinkObserved = request.form.get('geonamesLinkObserved')
-        pleiadesLinkObserved = request.form.get('pleiadesLinkObserved')
-        dateObserved = request.form.get('dateObserved')
-        datingCriteriaObserved = request.form.get('datingCriteriaObserved')
-        provenanceOtherLocations = request.form.get('provenanceOtherLocations')
-        latitudeOther = request.form.get('latitudeOther')
-        longitudeOther = request.form.get('longitudeOther')
-        geonamesLinkOtherLocations = request.form.get('geonamesLinkOtherLocations')
-        dateOtherLocations = request.form.get('dateOtherLocations')
-        datingCriteriaOtherLocations = request.form.get('datingCriteriaOtherLocations')
-        currentLocation = request.form.get('currentLocation')
-        latitudeCurrent = request.form.get('latitudeCurrent')
-        longitudeCurrent = request.form.get('longitudeCurrent')
-        geonamesLinkCurrent = request.form.get('geonamesLinkCurrent')
-        pleiadesLinkCurrent = request.form.get('pleiadesLinkCurrent')  
-        selected_categories = request.form.getlist('category')
-        selected_lists = request.form.getlist('list')
-        selected_items = request.form.getlist('item')
-        authorPublication = request.form.get('authorPublication')
-        startDate = request.form.get('startDate')
-        endDate = request.form.get('endDate')
-        ageContemporary = request.form.get('ageContemporary')
-        originalLanguage = request.form.get('originalLanguage')
-        publicationLanguage = request.form.get('publicationLanguage')
-        sourceInformation = request.form.get('sourceInformation')
-        annotation = request.form.get('annotation')
-        keywords = request.form.get('keywords')
-        sourceContent = request.form.get('sourceContent')
-        copyrightStoragePlace = request.form.get('copyrightStoragePlace')
-        viaf = request.form.get('viaf')
-        iiif = request.form.get('iiif')
-
-        # Create the XML structure
-        root = ET.Element("siteObject")
-
-        author_element = ET.SubElement(root, "author")
-        author_element.text = author
-        
-        name_source_element = ET.SubElement(root, "nameSource")
-        name_source_element.text = name_source
-        
-        name_contemporary_element = ET.SubElement(root, "nameContemporary")
-        name_contemporary_element.text = name_contemporary
-        
-        description_element = ET.SubElement(root, "description")
-        description_element.text = description
-        
-        provenance_origin_element = ET.SubElement(root, "provenanceOrigin")
-        provenance_origin_element.text = provenance_origin
-        
-        geographic_coordinates_element = ET.SubElement(root, "geographicCoordinates")
-        
-        latitude_element = ET.SubElement(geographic_coordinates_element, "latitude")
-        latitude_element.text = latitude
-        
-        longitude_element = ET.SubElement(geographic_coordinates_element, "longitude")
-        longitude_element.text = longitude
-
-        geonamesLink_element = ET.SubElement(root, 'geonamesLink')
-        geonamesLink_element.text = geonamesLink
-
-        pleiadesLink_element = ET.SubElement(root, 'pleiadesLink')
-        pleiadesLink_element.text = pleiadesLink
-
-        date_element = ET.SubElement(root, 'date')
-        date_element.text = date
-        
-        datingCriteria_element = ET.SubElement(root, 'datingCriteria')
-        datingCriteria_element.text = datingCriteria
-        
-        localizationSource_element = ET.SubElement(root, 'localizationSource')
-        localizationSource_element.text = localizationSource
-        
-
-        localizationCertainity_element = ET.SubElement(root, 'localizationCertainity')
-        localizationCertainity_element.text = localizationCertainity
-
-        age_element=ET.SubElement(root, 'age')
-        age_element.text = age
-
-        provenanceObservedIn_element = ET.SubElement(root, 'provenanceObservedIn')
-        provenanceObservedIn_element.text = provenanceObservedIn
-                
-        geographic_coordinatesObserved_element = ET.SubElement(root, "geographicCoordinatesObserved")
-        
-        latitudeObserved_element = ET.SubElement(geographic_coordinatesObserved_element, "latitudeObserved")
-        latitudeObserved_element.text = latitudeObserved
-        
-        longitudeObserved_element = ET.SubElement(geographic_coordinatesObserved_element, "longitudeObserved")
-        longitudeObserved_element.text = longitudeObserved
-              
-                
-        geonamesLinkObserved_element = ET.SubElement(root, 'geonamesLinkObserved')
-        geonamesLinkObserved_element.text = geonamesLinkObserved
-        
-        pleiadesLinkObserved_element = ET.SubElement(root, 'pleiadesLinkObserved')
-        pleiadesLinkObserved_element.text = pleiadesLinkObserved
-
-        dateObserved_element = ET.SubElement(root, 'dateObserved')
-        dateObserved_element.text = dateObserved
-        
-        datingCriteriaObserved_element = ET.SubElement(root, 'datingCriteriaObserved')
-        datingCriteriaObserved_element.text = datingCriteriaObserved
-
-        provenanceOtherLocations_element = ET.SubElement(root, 'provenanceOtherLocations')
-        provenanceOtherLocations_element.text = provenanceOtherLocations
-
-        geographic_coordinatesOther_element = ET.SubElement(root, "geographicCoordinatesOther")
-        
-        latitudeOther_element = ET.SubElement(geographic_coordinatesOther_element, "latitudeOther")
-        latitudeOther_element.text = latitudeOther
-        
-        longitudeOther_element = ET.SubElement(geographic_coordinatesOther_element, "longitudeOther")
-        longitudeOther_element.text = longitudeOther
-
-        geonamesLinkOtherLocations_element = ET.SubElement(root, 'geonamesLinkOtherLocations')
-        geonamesLinkOtherLocations_element.text = geonamesLinkOtherLocations
-
-        dateOtherLocations_element = ET.SubElement(root, 'dateOtherLocations')
-        dateOtherLocations_element.text = dateOtherLocations
-        
-        datingCriteriaOtherLocations_element = ET.SubElement(root, 'datingCriteriaOtherLocations')
-        datingCriteriaOtherLocations_element.text = datingCriteriaOtherLocations
-
-        currentLocationElem = ET.SubElement(root, 'currentLocation')
-        currentLocationElem.text = currentLocation
-
-        geographicCoordinatesCurrent_element = ET.SubElement(root, 'geographicCoordinatesCurrent')
-        
-        latitudeCurrent_element = ET.SubElement(geographicCoordinatesCurrent_element, 'latitudeCurrent')
-        latitudeCurrent_element.text = latitudeCurrent
-        
-        longitudeCurrent_element = ET.SubElement(geographicCoordinatesCurrent_element, 'longitudeCurrent')
-        longitudeCurrent_element.text = longitudeCurrent
-
-        geonamesLinkCurrent_element = ET.SubElement(root, 'geonamesLinkCurrent')
-        geonamesLinkCurrent_element.text = geonamesLinkCurrent
-
-        pleiadesLinkCurrent_element = ET.SubElement(root, 'pleiadesLinkCurrent')
-        pleiadesLinkCurrent_element.text = pleiadesLinkCurrent
-
-         # Extract the selected categories and their subcategories
-        selected_categories = request.form.getlist('categories[]')
-
-        # Create a dictionary to map category names to their respective subcategories
-        category_subcategory_mapping = {
-            "communication":request.form.getlist('communication_subcategories[]'),
-            "religious": request.form.getlist('religious_subcategories[]'),
-            "inscriptions": request.form.getlist('inscriptions_subcategories[]'),
-            "fortifications": request.form.getlist('fortifications_subcategories[]'),
-            "settlements": request.form.getlist('settlements_subcategories[]'),
-            "linear":request.form.getlist('linear_subcategories[]'),
-            "manuscripts": request.form.getlist('manuscript_subcategories[]'),
-            "water": request.form.getlist('water_subcategories[]'),
-            "economy": request.form.getlist('economy_subcategories[]'),
-            "other": request.form.getlist('other_subcategories[]'),
-            "burials": request.form.getlist('burials_subcategories[]'),
-            # Add more category-subcategory mappings as needed
-        }
-
-        # Iterate through selected categories and generate XML elements for subcategories
-        for category_name in selected_categories:
-            if category_name in category_subcategory_mapping:
-                subcategories = category_subcategory_mapping[category_name]
-
-                # Wrap the subcategories in <desc type="category"> and <list type="subcategory">
-                category_element = ET.Element("desc", type="category")
-                list_element = ET.Element("list", type=category_name)
-
-                for subcategory in subcategories:
-                    item_element = ET.Element("item")
-                    item_element.text = subcategory
-                    list_element.append(item_element)
-
-                category_element.append(list_element)
-                root.append(category_element)
-            else:
-                # This is a category with no subcategories, wrap it in <desc type="category">
-                category_element = ET.Element("desc", type="category")
-                category_element.text = category_name
-                root.append(category_element)
-
-        authorPublication_element = ET.SubElement(root,'authorPublication')
-        authorPublication_element.text = authorPublication
-
-        informationDates_element = ET.SubElement(root, 'informationDates')
-        
-        startDate_element = ET.SubElement(informationDates_element, 'startDate')
-        startDate_element.text = startDate
-        endDate_element = ET.SubElement(informationDates_element, 'endDate')
-        endDate_element.text = endDate
-
-        age_contemporary_element=ET.SubElement(root, 'ageContemporary')
-        age_contemporary_element.text = ageContemporary
-
-        originalLanguage_element= ET.SubElement(root, 'originalLanguage', {'xml:lang': originalLanguage})        
-        originalLanguage_element.text = originalLanguage
-
-        publicationLanguage_element = ET.SubElement(root, 'publicationLanguage', {'xml:lang': publicationLanguage})
-        publicationLanguage_element.text = publicationLanguage
-               
-        sourceInformation_element = ET.SubElement(root, 'sourceInformation')
-        sourceInformation_element.text = sourceInformation
-        
-        annotation_element= ET.SubElement(root, 'annotation')
-        annotation_element.text = annotation
-        
-        keywords_element = ET.SubElement(root, 'keywords')
-        keywords_element.text = keywords
-        
-        sourceContent_element = ET.SubElement(root, 'sourceContent')
-        sourceContent_element.text = sourceContent
-        
-        copyrightStoragePlace_element = ET.SubElement(root, 'copyrightStoragePlace')
-        copyrightStoragePlace_element.text = copyrightStoragePlace
-        
-        viaf_element = ET.SubElement(root, 'viaf')
-        viaf_element.text = viaf
-        
-        iiif_element = ET.SubElement(root, 'iiif')
-        iiif_element.text = iiif
-
-        # Write XML to file
-        filename = request.form['filename']
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{filename}.xml")
-        xml_string = ET.tostring(root, encoding='utf-8')
-        xml_pretty = xml.dom.minidom.parseString(xml_string).toprettyxml(indent='    ')
-        with codecs.open(filepath, "w", "utf-8") as xml_file:
-            xml_file.write(xml_pretty)
-
-        return render_template('success.html')
-
-    except Exception as e:
-        print(e)
+        with metrics.phase('submit', 'extract'):
+            values, categories = parse_form(request.form)
+            errors = validate_site_values(values, categories)
+            if errors:
+                return "Invalid submission: " + "; ".join(errors), 400
+
+        # Checked before anything is written or queued, so a write-behind
+        # submission is never acknowledged and then dropped by the writer.
+        filename = f"{values['filename']}.xml"
+        if not valid_name(filename):
+            return "Invalid submission: filename must not contain path separators or start with '.'", 400
+
+        # Write XML to file, unless a record of that name exists and the
+        # editor did not confirm replacing it.
+        overwrite = request.form.get('overwrite') == '1'
+        if app.config['WRITE_BEHIND']:
+            if not overwrite and upload_exists(filename):
+                return already_exists(filename)
+            with metrics.phase('submit', 'enqueue'):
+                try:
+                    write_queue.put(filename, values, categories, overwrite=overwrite)
+                except FileExistsError:
+                    # An earlier submission of the same name is still queued.
+                    return already_exists(filename)
+        else:
+            with metrics.phase('submit', 'serialise'):
+                xml_pretty = build_site_xml(values, categories)
+            with metrics.phase('submit', 'write'):
+                try:
+                    store_upload(filename, xml_pretty.encode('utf-8'), overwrite=overwrite)
+                except FileExistsError:
+                    return already_exists(filename)
+
+        # Checked against the records as they are; rescanning the folder here
+        # would cost far more than the lookup.
+        with metrics.phase('submit', 'dedup'):
+            site_object = site_object_of(values)
+            duplicates = duplicate_index.candidates(
+                [site_object['nameSource'], site_object['nameContemporary']],
+                site_points(site_object),
+                exclude=filename
+            )
+        return render_template('success.html', duplicates=duplicates)
+
+    except Exception:
+        app.logger.exception("Submission failed")
+        metrics.inc('digitalsee_errors_total', endpoint='submit')
         return "An error occurred", 500
 
+def already_exists(filename):
+    return (
+        f"A record named {filename} already exists. "
+        "Choose another filename, or submit again with overwrite=1 to replace it."
+    ), 409
+
+@app.route('/api/watcher')
+def api_watcher():
+    if upload_watcher is None:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, pid=os.getpid(), **upload_watcher.status())
+
+@app.route('/api/write-queue')
+def api_write_queue():
+    if not app.config['WRITE_BEHIND']:
+        return jsonify(enabled=False)
+    return jsonify(enabled=True, pid=os.getpid(), **write_queue.status())
+
 @app.route('/uploads/<filename>')
 def download_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    encoding = negotiate_encoding(request.accept_encodings)
+    # The cached digest answers a revalidation without reading the file.
+    digest = store.etag(filename)
+    if digest is not None and request.if_none_match.contains(representation_etag(digest, encoding)):
+        return not_modified(representation_etag(digest, encoding))
+
+    content = read_upload(filename)
+    if content is None:
+        abort(404)
+    if digest is None:
+        digest = content_digest(content)
+        if request.if_none_match.contains(representation_etag(digest, encoding)):
+            return not_modified(representation_etag(digest, encoding))
+
+    response = Response(content, mimetype='application/xml')
+    response.vary.add('Accept-Encoding')
+    if encoding is not None and len(content) >= app.config['COMPRESS_MIN_SIZE']:
+        response.set_data(compressed_xml.get(digest, encoding, content))
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(representation_etag(digest, encoding))
+    return response
+
+def read_upload(filename):
+    if app.config['RECORD_STORE'] == 'sqlite':
+        return store.get_xml(filename)
+    return upload_folder.read(filename)
 
 @app.route('/upload', methods=['POST'])
 def upload():
@@ -433,36 +443,369 @@ def upload():
         return 'No selected file'
     if xml_file and allowed_file(xml_file.filename):
         filename = secure_filename(xml_file.filename)
-        xml_file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        try:
+            store_upload(filename, xml_file.read())
+        except ValueError as e:
+            return f'Invalid file uploaded: {e}', 400
         return redirect('/')
     return 'Invalid file uploaded.'
 
+@app.route('/upload-bulk', methods=['POST'])
+def upload_bulk():
+    if 'archive' not in request.files:
+        return 'No file part', 400
+    archive = request.files['archive']
+    if archive.filename == '':
+        return 'No selected file', 400
+
+    summary = {'imported': 0, 'invalid': 0, 'conflict': 0, 'failed': 0}
+    records = []
+    refresh_store(app.config['API_REFRESH_INTERVAL'])
+    try:
+        for report in import_records(
+            archive.stream,
+            archive.filename,
+            store_upload,
+            workers=app.config['BULK_IMPORT_WORKERS'],
+            batch_size=app.config['BULK_IMPORT_BATCH_SIZE'],
+            overwrite=request.form.get('overwrite') == '1'
+        ):
+            summary[report['status']] += 1
+            if report['status'] == 'imported':
+                report['duplicates'] = duplicate_index.duplicates_of(report['filename'])
+            records.append(report)
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        return jsonify(error=f"Cannot read {archive.filename}: {e}", records=records, **summary), 400
+    return jsonify(records=records, **summary)
+
+@app.cli.command('import-bulk')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=int, default=None, help='Worker processes (default: one per CPU, 0 for none).')
+@click.option('--batch-size', type=int, default=256, show_default=True)
+@click.option('--report', type=click.File('w'), help='Write the per-record report to this file as JSON lines.')
+@click.option('--overwrite', is_flag=True, help='Replace existing records of the same name instead of reporting a conflict.')
+def import_bulk_command(paths, workers, batch_size, report, overwrite):
+    """Import siteObject records from ZIP/tar archives or multi-record XML files."""
+    summary = {'imported': 0, 'invalid': 0, 'conflict': 0, 'failed': 0}
+    store.refresh()
+    for path in paths:
+        with open(path, 'rb') as archive:
+            for record in import_records(
+                archive, path, store_upload, workers=workers, batch_size=batch_size, overwrite=overwrite
+            ):
+                summary[record['status']] += 1
+                if record['status'] == 'imported':
+                    record['duplicates'] = duplicate_index.duplicates_of(record['filename'])
+                    if record['duplicates']:
+                        similar = ', '.join(duplicate['filename'] for duplicate in record['duplicates'])
+                        click.echo(f"{record['source']}: {record['filename']}: possible duplicate of {similar}", err=True)
+                if report is not None:
+                    report.write(json.dumps(record, ensure_ascii=False) + '\n')
+                if record['errors']:
+                    click.echo(f"{record['source']}: {record['filename'] or '-'}: {'; '.join(record['errors'])}", err=True)
+    click.echo(', '.join(f"{count} {status}" for status, count in summary.items()))
+
+def sqlite_store():
+    return store if isinstance(store, SqliteStore) else SqliteStore(app.config['SQLITE_DATABASE'])
+
+@app.cli.command('migrate-to-sqlite')
+@click.option('--folder', default=None, help='Folder of XML files (default: UPLOAD_FOLDER).')
+def migrate_to_sqlite_command(folder):
+    """Copy the XML files into the SQLite store; re-running skips files already copied."""
+    source = FlatFolder(folder) if folder else upload_folder
+    target = sqlite_store()
+    migrated = target.stat_keys()
+    counts = {'migrated': 0, 'unchanged': 0, 'invalid': 0}
+    for filename in sorted(source.scan()):
+        path = source.path(filename)
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if migrated.get(filename) == key:
+            counts['unchanged'] += 1
+            continue
+        with open(path, 'rb') as xml_file:
+            content = xml_file.read()
+        if target.put(filename, content, key) is None:
+            counts['invalid'] += 1
+        else:
+            counts['migrated'] += 1
+    click.echo(', '.join(f"{count} {status}" for status, count in counts.items()))
+
+@app.cli.command('export-xml')
+@click.option('--folder', default=None, help='Destination folder (default: UPLOAD_FOLDER).')
+def export_xml_command(folder):
+    """Write every record of the SQLite store out as its original XML file."""
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    target = FlatFolder(folder) if folder else upload_folder
+    written = 0
+    for filename, content in sqlite_store().iter_xml():
+        with file_lock(app.config['LOCK_FOLDER'], filename):
+            if target.read(filename) == content:
+                continue
+            target.write(filename, content)
+        written += 1
+    click.echo(f"{written} file(s) written to {target.root}")
+
+@app.cli.command('migrate-to-sharded')
+@click.option('--rebuild-manifest', is_flag=True, help='Also rewrite the manifest from the files already in shards.')
+def migrate_to_sharded_command(rebuild_manifest):
+    """Move the XML files of UPLOAD_FOLDER into hash-prefix shards listed in a manifest.
+
+    Converts a flat folder in place and is safe to interrupt and re-run.
+    Restart the app afterwards; a folder with a manifest is read as sharded.
+    """
+    folder = upload_folder if isinstance(upload_folder, ShardedFolder) else ShardedFolder(
+        app.config['UPLOAD_FOLDER'], app.config['LOCK_FOLDER']
+    )
+    moved = folder.adopt_all()
+    if rebuild_manifest:
+        folder.rebuild_manifest()
+    elif not os.path.exists(folder.manifest.path):
+        folder.manifest.replace({})
+    click.echo(f"{moved} file(s) moved into shards, {len(folder.manifest.entries)} listed in {folder.manifest.path}")
+
+def page_start(filenames, after, page, page_size, ranked):
+    # `after` is a cursor naming the last file of the previous page. Plain
+    # listings are sorted by filename, so the cursor still works if that file
+    # has since been deleted; ranked search results fall back to the page number.
+    if after:
+        if not ranked:
+            return bisect.bisect_right(filenames, after)
+        if after in filenames:
+            return filenames.index(after) + 1
+    return (max(page, 1) - 1) * page_size
+
+def iter_records(filenames):
+    for filename in filenames:
+        site_object = store.get(filename)
+        if site_object is not None:
+            yield filename, site_object
+
+def request_filters():
+    return {name: request.args.getlist(name) for name in FACET_TITLES if request.args.getlist(name)}
+
+def select_filenames(search_query, filters):
+    # Returns the matching filenames (ranked when searching, sorted otherwise)
+    # and the bitmap of the search results for restricting facet counts.
+    if not search_query:
+        return (facet_index.filenames(filters) if filters else store.filenames()), None
+    filenames = search_index.search(search_query)
+    within = facet_index.bitmap(filenames)
+    if filters:
+        matching = set(facet_index.filenames(filters, within))
+        filenames = [filename for filename in filenames if filename in matching]
+    return filenames, within
+
+def facet_links(search_query, filters, counts):
+    facets = []
+    for name, title in FACET_TITLES.items():
+        values = []
+        for value, count in sorted(counts[name].items()):
+            selected = value in filters.get(name, [])
+            toggled = dict(filters)
+            toggled[name] = [v for v in filters.get(name, []) if v != value] if selected else filters.get(name, []) + [value]
+            values.append({
+                'label': FACET_LABELS[name].get(value, value),
+                'count': count,
+                'selected': selected,
+                'url': url_for('view_uploads', search=search_query or None, **toggled),
+            })
+        if values:
+            facets.append({'title': title, 'values': values})
+    return facets
+
 @app.route('/view-uploads', methods=['GET', 'POST'])
 def view_uploads():
     search_query = request.args.get('search', '').lower()
+    after = request.args.get('after')
+    page = request.args.get('page', 1, type=int)
+    page_size = app.config['UPLOADS_PAGE_SIZE']
+    filters = request_filters()
     
     try:
-        files = [f for f in os.listdir(app.config['UPLOAD_FOLDER']) if f.endswith('.xml')]
-        
-        xml_contents = {}
-        for filename in files:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            with open(filepath, 'r', encoding='utf-8') as xml_file:
-                content = xml_file.read()
-                root = ET.fromstring(content)
-                site_object = {child.tag: child.text for child in root}
-                xml_contents[filename] = site_object
-
-        if search_query:
-            xml_contents = {k: v for k, v in xml_contents.items() if any(search_query in str(value).lower() for value in v.values())}
-
-        return render_template('view_uploads.html', xml_contents=xml_contents, search_query=search_query)
+        with metrics.phase('view_uploads', 'scan'):
+            refresh_store()
+
+        # The page depends only on the records and the query, so a client
+        # that has it for the current corpus generation gets a 304.
+        stream = request.args.get('stream') == '1'
+        etag = representation_etag(
+            content_digest(json.dumps(
+                [store.generation(), LISTING_TEMPLATE_DIGEST, page_size, sorted(request.args.items(multi=True))]
+            )),
+            None if stream else negotiate_encoding(request.accept_encodings)
+        )
+        if request.method == 'GET' and request.if_none_match.contains(etag):
+            return not_modified(etag)
+
+        with metrics.phase('view_uploads', 'filter'):
+            filenames, within = select_filenames(search_query, filters)
+            facet_counts = facet_index.counts(filters, within)
+
+        start = page_start(filenames, after, page, page_size, ranked=bool(search_query))
+        page_filenames = filenames[start:start + page_size]
+        next_cursor = page_filenames[-1] if start + page_size < len(filenames) else None
+
+        context = dict(
+            records=iter_records(page_filenames),
+            search_query=search_query,
+            filters=filters,
+            facets=facet_links(search_query, filters, facet_counts),
+            page=max(page, 1),
+            next_cursor=next_cursor,
+            total=len(filenames)
+        )
+        if stream:
+            # Rows are sent to the client as they are rendered instead of
+            # building the whole page in memory first.
+            response = Response(stream_template('view_uploads.html', **context))
+        else:
+            with metrics.phase('view_uploads', 'render'):
+                response = Response(render_template('view_uploads.html', **context))
+        response.set_etag(etag)
+        return response
     
-    except Exception as e:
-        print(e)
+    except Exception:
+        app.logger.exception("Listing uploads failed")
+        metrics.inc('digitalsee_errors_total', endpoint='view_uploads')
         return "An error occurred", 500
 
+@app.route('/export')
+def export():
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify(error=f"format must be one of {', '.join(EXPORT_FORMATS)}"), 400
+    writer, mimetype, extension = EXPORT_FORMATS[export_format]
+    refresh_store(app.config['API_REFRESH_INTERVAL'])
+    filenames, _ = select_filenames(request.args.get('search', '').lower(), request_filters())
+    # Streamed in chunks; records are read one at a time as the client consumes them.
+    response = Response(writer(iter_records(filenames)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="digitalsee-export.{extension}"'
+    return response
+
+@app.cli.command('export')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson', show_default=True)
+@click.option('--output', type=click.File('wb'), default='-', help='Destination file (default: standard output).')
+@click.option('--search', default='', help='Only export records matching this search.')
+@click.option('--filter', 'filter_values', multiple=True, metavar='FACET=VALUE',
+              help='Only export records with this facet value, e.g. category=religious (repeatable).')
+def export_command(export_format, output, search, filter_values):
+    """Export all records, or a filtered subset, as CSV, NDJSON, GeoJSON or columnar binary."""
+    filters = {}
+    for filter_value in filter_values:
+        name, _, value = filter_value.partition('=')
+        if name not in FACET_TITLES or not value:
+            raise click.BadParameter(f"expected one of {', '.join(FACET_TITLES)} followed by =VALUE", param_hint='--filter')
+        filters.setdefault(name, []).append(value)
+    store.refresh()
+    filenames, _ = select_filenames(search.lower(), filters)
+    writer = EXPORT_FORMATS[export_format][0]
+    for chunk in writer(iter_records(filenames)):
+        output.write(chunk)
+    click.echo(f"{len(filenames)} record(s) exported", err=True)
+
+@app.route('/api/facets')
+def api_facets():
+    search_query = request.args.get('search', '').lower()
+    filters = request_filters()
+    limit = request.args.get('limit', 100, type=int)
+    refresh_store(app.config['API_REFRESH_INTERVAL'])
+    filenames, within = select_filenames(search_query, filters)
+    return jsonify(
+        count=len(filenames),
+        filenames=filenames[:limit],
+        facets=facet_index.counts(filters, within)
+    )
+
+
+
+def parse_coordinates(value, limits):
+    # Comma-separated decimal degrees, the i-th within +-limits[i]; NaN and
+    # infinities fail the range check too.
+    parts = value.split(',')
+    if len(parts) != len(limits):
+        raise ValueError(f"expected {len(limits)} comma-separated numbers")
+    return [parse_coordinate(part, limit) for part, limit in zip(parts, limits)]
+
+def parse_radius(value):
+    radius_km = float(value)
+    if not math.isfinite(radius_km) or radius_km <= 0:
+        raise ValueError(f"radius_km must be a positive number, got {value!r}")
+    return radius_km
+
+def site_json(filename, kind, latitude, longitude):
+    site_object = store.get(filename) or {}
+    return {
+        'filename': filename,
+        'kind': kind,
+        'latitude': latitude,
+        'longitude': longitude,
+        'nameSource': site_object.get('nameSource'),
+        'nameContemporary': site_object.get('nameContemporary'),
+    }
 
+@app.route('/api/sites')
+def api_sites():
+    kinds = request.args.getlist('kind')
+    try:
+        refresh_store(app.config['API_REFRESH_INTERVAL'])
+        if 'bbox' in request.args:
+            min_lon, min_lat, max_lon, max_lat = parse_coordinates(request.args['bbox'], (180, 90, 180, 90))
+            sites = [site_json(*point) for point in spatial_index.bbox(min_lon, min_lat, max_lon, max_lat)]
+        elif 'near' in request.args:
+            latitude, longitude = parse_coordinates(request.args['near'], (90, 180))
+            radius_km = parse_radius(request.args.get('radius_km', '10'))
+            sites = []
+            for distance, *point in spatial_index.near(latitude, longitude, radius_km):
+                site = site_json(*point)
+                site['distance_km'] = round(distance, 3)
+                sites.append(site)
+        else:
+            return jsonify(error="Pass either bbox=minLon,minLat,maxLon,maxLat or near=lat,lon&radius_km="), 400
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    if kinds:
+        sites = [site for site in sites if site['kind'] in kinds]
+    return jsonify(count=len(sites), sites=sites)
+
+@app.route('/api/duplicates')
+def api_duplicates():
+    try:
+        limit = int(request.args.get('limit', 10))
+        refresh_store(app.config['API_REFRESH_INTERVAL'])
+        if 'filename' in request.args:
+            filename = request.args['filename']
+            if store.get(filename) is None:
+                abort(404)
+            duplicates = duplicate_index.duplicates_of(filename, limit=limit)
+        elif 'name' in request.args:
+            points = []
+            if 'near' in request.args:
+                latitude, longitude = parse_coordinates(request.args['near'], (90, 180))
+                points.append(('origin', latitude, longitude))
+            duplicates = duplicate_index.candidates(request.args.getlist('name'), points, limit=limit)
+        else:
+            return jsonify(error="Pass either filename= or name= (repeatable) with an optional near=lat,lon"), 400
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(count=len(duplicates), duplicates=duplicates)
+
+@app.cli.command('find-duplicates')
+@click.option('--output', type=click.File('w'), default='-', help='Write the clusters here (default: stdout).')
+@click.option('--json', 'as_json', is_flag=True, help='Write JSON lines with every member\'s scores.')
+def find_duplicates_command(output, as_json):
+    """Group the whole archive into clusters of probable duplicates."""
+    store.refresh()
+    clusters = duplicate_index.clusters()
+    for cluster in clusters:
+        if as_json:
+            members = {filename: duplicate_index.duplicates_of(filename, limit=None) for filename in cluster}
+            output.write(json.dumps({'filenames': cluster, 'duplicates': members}, ensure_ascii=False) + '\n')
+        else:
+            output.write(' '.join(cluster) + '\n')
+    click.echo(f"{len(clusters)} clusters, {sum(map(len, clusters))} records", err=True)
 
 @app.errorhandler(404)
 def page_not_found(e):
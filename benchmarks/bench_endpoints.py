@@ -0,0 +1,318 @@
+"""Latency, throughput and peak RSS of the submit, upload and view-uploads paths.
+
+For every corpus size a synthetic corpus (see corpus.py) is generated and the
+app is driven from a child process, either through Flask's test client or over
+HTTP against a local pre-forked multi-worker WSGI server. Results are saved as
+JSON so runs on different commits can be compared:
+
+    python benchmarks/bench_endpoints.py --sizes 1000 10000 --output before.json
+    python benchmarks/bench_endpoints.py --sizes 1000 10000 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+
+import corpus  # noqa: E402
+
+GET_SCENARIOS = [
+    ('view_uploads', '/view-uploads'),
+    ('view_uploads_page_10', '/view-uploads?page=10'),
+    ('search', '/view-uploads?search=church'),
+    ('search_field', '/view-uploads?search=author:macmichael'),
+    ('facets', '/view-uploads?category=religious&age=roman_age'),
+    ('api_sites_bbox', '/api/sites?bbox=25,42,25.5,42.5'),
+]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarise(latencies, statuses, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+def submit_form(rng):
+    form, categories = corpus.site_form(rng)
+    form['filename'] = f"bench_{uuid.uuid4().hex}"
+    form['categories[]'] = [category for category, _ in categories]
+    for category, subcategories in categories:
+        form[f"{category}_subcategories[]"] = subcategories
+    return form
+
+
+def multipart(filename, content):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"xml_file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/xml\r\n\r\n"
+    ).encode('utf-8') + content + f"\r\n--{boundary}--\r\n".encode('utf-8')
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class TestClientDriver:
+    """Sequential requests through Flask's test client, in this process."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        response.get_data()
+        return response.status_code
+
+    def submit(self, form):
+        return self.client.post('/submit', data=form).status_code
+
+    def upload(self, filename, content):
+        body, content_type = multipart(filename, content)
+        return self.client.post('/upload', data=body, content_type=content_type).status_code
+
+    def run(self, requests, _concurrency):
+        latencies = []
+        statuses = []
+        started = time.perf_counter()
+        for request in requests:
+            before = time.perf_counter()
+            statuses.append(request(self))
+            latencies.append(time.perf_counter() - before)
+        return latencies, statuses, time.perf_counter() - started
+
+
+class HttpDriver:
+    """Concurrent HTTP requests against a pre-forked WSGI server."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def _open(self, request):
+        try:
+            with urlopen(request, timeout=600) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+    def get(self, path):
+        return self._open(self.base_url + path)
+
+    def submit(self, form):
+        data = urlencode(form, doseq=True).encode('utf-8')
+        return self._open(Request(self.base_url + '/submit', data=data))
+
+    def upload(self, filename, content):
+        body, content_type = multipart(filename, content)
+        return self._open(Request(self.base_url + '/upload', data=body, headers={'Content-Type': content_type}))
+
+    def run(self, requests, concurrency):
+        def timed(request):
+            before = time.perf_counter()
+            status = request(self)
+            return time.perf_counter() - before, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies, statuses = zip(*executor.map(timed, requests))
+        return list(latencies), list(statuses), time.perf_counter() - started
+
+
+def scenarios(count, rng):
+    """(name, [request callables]) in the order they are run."""
+    yield 'view_uploads_cold', [lambda driver: driver.get('/view-uploads')]
+    for name, path in GET_SCENARIOS:
+        yield name, [lambda driver, path=path: driver.get(path)] * count
+    forms = [submit_form(rng) for _ in range(count)]
+    yield 'submit', [lambda driver, form=form: driver.submit(form) for form in forms]
+    uploads = [(f"bench_upload_{uuid.uuid4().hex}.xml", corpus.site_xml(rng).encode('utf-8')) for _ in range(count)]
+    yield 'upload', [lambda driver, upload=upload: driver.upload(*upload) for upload in uploads]
+
+
+def peak_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def serve_preforked(app, workers):
+    """Start `workers` forked WSGI servers sharing one listening socket; return (base URL, worker pids)."""
+    from werkzeug.serving import make_server
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    listener.set_inheritable(True)
+    port = listener.getsockname()[1]
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            server = make_server('127.0.0.1', port, app, threaded=True, fd=listener.fileno())
+            server.serve_forever()
+            os._exit(0)
+        pids.append(pid)
+    return f"http://127.0.0.1:{port}", pids
+
+
+def run_child(args):
+    # Runs inside the corpus folder, so the app's relative uploads/ and cache/ point at the corpus.
+    import logging
+    logging.disable(logging.WARNING)
+    import app as app_module
+
+    app = app_module.app
+    if app.config['RECORD_STORE'] == 'sqlite':
+        with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+            for entry in entries:
+                with open(entry.path, 'rb') as xml_file:
+                    app_module.store.put(entry.name, xml_file.read())
+
+    rng = random.Random(args.seed)
+    pids = []
+    if args.mode == 'wsgi':
+        base_url, pids = serve_preforked(app, args.workers)
+        driver = HttpDriver(base_url)
+        time.sleep(0.2)
+    else:
+        driver = TestClientDriver(app)
+
+    results = {}
+    try:
+        for name, requests in scenarios(args.requests, rng):
+            latencies, statuses, elapsed = driver.run(requests, args.concurrency)
+            results[name] = summarise(latencies, statuses, elapsed)
+    finally:
+        if pids:
+            results['peak_rss_kb'] = max(filter(None, (peak_rss_kb(pid) for pid in pids)), default=None)
+            for pid in pids:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+        else:
+            results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    json.dump(results, sys.stdout)
+
+
+def run_size(size, mode, args):
+    workdir = tempfile.mkdtemp(prefix=f"digitalsee-bench-{size}-")
+    try:
+        started = time.perf_counter()
+        corpus.generate(os.path.join(workdir, 'uploads'), size, seed=args.seed)
+        print(f"  generated {size} records in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child', '--mode', mode,
+            '--requests', str(args.requests), '--workers', str(args.workers),
+            '--concurrency', str(args.concurrency), '--seed', str(args.seed),
+        ]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, BENCHMARKS]))
+        output = subprocess.run(command, cwd=workdir, env=env, check=True, stdout=subprocess.PIPE).stdout
+        return json.loads(output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print p50/p99 ratios against a baseline run; return True if anything regressed by more than `threshold`."""
+    regressed = False
+    print(f"{'size':>7} {'mode':10} {'scenario':22} {'p50 ratio':>10} {'p99 ratio':>10}")
+    for size, modes in current['results'].items():
+        for mode, scenarios_ in modes.items():
+            old_scenarios = baseline.get('results', {}).get(size, {}).get(mode, {})
+            for name, result in scenarios_.items():
+                old = old_scenarios.get(name)
+                if not isinstance(result, dict) or not old:
+                    continue
+                ratios = [result[key] / old[key] if old[key] else 1.0 for key in ('p50_ms', 'p99_ms')]
+                flag = ' REGRESSION' if max(ratios) > 1 + threshold else ''
+                regressed = regressed or bool(flag)
+                print(f"{size:>7} {mode:10} {name:22} {ratios[0]:>10.2f} {ratios[1]:>10.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--modes', nargs='+', choices=['testclient', 'wsgi'], default=['testclient', 'wsgi'])
+    parser.add_argument('--requests', type=int, default=50, help='Requests per scenario.')
+    parser.add_argument('--workers', type=int, default=4, help='WSGI worker processes.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent HTTP clients in wsgi mode.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Baseline JSON file to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before flagging a regression.')
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'record_store': os.environ.get('RECORD_STORE', 'files'),
+        'requests_per_scenario': args.requests,
+        'results': {},
+    }
+    for size in args.sizes:
+        for mode in args.modes:
+            print(f"{size} records, {mode}", file=sys.stderr)
+            report['results'].setdefault(str(size), {})[mode] = run_size(size, mode, args)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""Per-submission CPU time and allocations of the siteObject XML writer.
+
+Compares the original submit() serialisation (ElementTree -> tostring ->
+minidom.parseString -> toprettyxml) with site_xml.build_site_xml, after
+checking that both produce byte-identical documents for randomised forms.
+
+    python benchmarks/bench_serialise.py [--iterations N]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+import xml.dom.minidom
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from site_xml import build_site_xml, SITE_OBJECT_SCHEMA, GROUP, TEXT, LANGUAGE  # noqa: E402
+
+SUBCATEGORY_FIELDS = {
+    "communication": 'communication_subcategories[]',
+    "religious": 'religious_subcategories[]',
+    "inscriptions": 'inscriptions_subcategories[]',
+    "fortifications": 'fortifications_subcategories[]',
+    "settlements": 'settlements_subcategories[]',
+    "linear": 'linear_subcategories[]',
+    "manuscripts": 'manuscript_subcategories[]',
+    "water": 'water_subcategories[]',
+    "economy": 'economy_subcategories[]',
+    "other": 'other_subcategories[]',
+    "burials": 'burials_subcategories[]',
+}
+
+
+class FakeForm(dict):
+    """The subset of werkzeug's MultiDict used by submit()."""
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        return value[0] if isinstance(value, list) else value
+
+    def getlist(self, key):
+        value = super().get(key, [])
+        return value if isinstance(value, list) else [value]
+
+
+def legacy_serialise(form):
+    # Verbatim from submit() before the schema-driven writer.
+    author = form.get('author')
+    name_source = form.get('name_source')
+    name_contemporary = form.get('name_contemporary')
+    description = form.get('description')
+    provenance_origin = form.get('provenance_origin')
+    latitude = form.get('latitude')
+    longitude = form.get('longitude')
+    geonamesLink = form.get('geonamesLink')
+    pleiadesLink = form.get('pleiadesLink')
+    date = form.get('date')
+    datingCriteria = form.get('datingCriteria')
+    localizationSource = form.get('localizationSource')
+    localizationCertainity = form.get('localizationCertainity')
+    age = form.get('age')
+    provenanceObservedIn = form.get('provenanceObservedIn')
+    latitudeObserved = form.get('latitudeObserved')
+    longitudeObserved = form.get('longitudeObserved')
+    geonamesLinkObserved = form.get('geonamesLinkObserved')
+    pleiadesLinkObserved = form.get('pleiadesLinkObserved')
+    dateObserved = form.get('dateObserved')
+    datingCriteriaObserved = form.get('datingCriteriaObserved')
+    provenanceOtherLocations = form.get('provenanceOtherLocations')
+    latitudeOther = form.get('latitudeOther')
+    longitudeOther = form.get('longitudeOther')
+    geonamesLinkOtherLocations = form.get('geonamesLinkOtherLocations')
+    dateOtherLocations = form.get('dateOtherLocations')
+    datingCriteriaOtherLocations = form.get('datingCriteriaOtherLocations')
+    currentLocation = form.get('currentLocation')
+    latitudeCurrent = form.get('latitudeCurrent')
+    longitudeCurrent = form.get('longitudeCurrent')
+    geonamesLinkCurrent = form.get('geonamesLinkCurrent')
+    pleiadesLinkCurrent = form.get('pleiadesLinkCurrent')  
+    selected_categories = form.getlist('category')
+    selected_lists = form.getlist('list')
+    selected_items = form.getlist('item')
+    authorPublication = form.get('authorPublication')
+    startDate = form.get('startDate')
+    endDate = form.get('endDate')
+    ageContemporary = form.get('ageContemporary')
+    originalLanguage = form.get('originalLanguage')
+    publicationLanguage = form.get('publicationLanguage')
+    sourceInformation = form.get('sourceInformation')
+    annotation = form.get('annotation')
+    keywords = form.get('keywords')
+    sourceContent = form.get('sourceContent')
+    copyrightStoragePlace = form.get('copyrightStoragePlace')
+    viaf = form.get('viaf')
+    iiif = form.get('iiif')
+
+    # Create the XML structure
+    root = ET.Element("siteObject")
+
+    author_element = ET.SubElement(root, "author")
+    author_element.text = author
+
+    name_source_element = ET.SubElement(root, "nameSource")
+    name_source_element.text = name_source
+
+    name_contemporary_element = ET.SubElement(root, "nameContemporary")
+    name_contemporary_element.text = name_contemporary
+
+    description_element = ET.SubElement(root, "description")
+    description_element.text = description
+
+    provenance_origin_element = ET.SubElement(root, "provenanceOrigin")
+    provenance_origin_element.text = provenance_origin
+
+    geographic_coordinates_element = ET.SubElement(root, "geographicCoordinates")
+
+    latitude_element = ET.SubElement(geographic_coordinates_element, "latitude")
+    latitude_element.text = latitude
+
+    longitude_element = ET.SubElement(geographic_coordinates_element, "longitude")
+    longitude_element.text = longitude
+
+    geonamesLink_element = ET.SubElement(root, 'geonamesLink')
+    geonamesLink_element.text = geonamesLink
+
+    pleiadesLink_element = ET.SubElement(root, 'pleiadesLink')
+    pleiadesLink_element.text = pleiadesLink
+
+    date_element = ET.SubElement(root, 'date')
+    date_element.text = date
+
+    datingCriteria_element = ET.SubElement(root, 'datingCriteria')
+    datingCriteria_element.text = datingCriteria
+
+    localizationSource_element = ET.SubElement(root, 'localizationSource')
+    localizationSource_element.text = localizationSource
+
+
+    localizationCertainity_element = ET.SubElement(root, 'localizationCertainity')
+    localizationCertainity_element.text = localizationCertainity
+
+    age_element=ET.SubElement(root, 'age')
+    age_element.text = age
+
+    provenanceObservedIn_element = ET.SubElement(root, 'provenanceObservedIn')
+    provenanceObservedIn_element.text = provenanceObservedIn
+
+    geographic_coordinatesObserved_element = ET.SubElement(root, "geographicCoordinatesObserved")
+
+    latitudeObserved_element = ET.SubElement(geographic_coordinatesObserved_element, "latitudeObserved")
+    latitudeObserved_element.text = latitudeObserved
+
+    longitudeObserved_element = ET.SubElement(geographic_coordinatesObserved_element, "longitudeObserved")
+    longitudeObserved_element.text = longitudeObserved
+
+
+    geonamesLinkObserved_element = ET.SubElement(root, 'geonamesLinkObserved')
+    geonamesLinkObserved_element.text = geonamesLinkObserved
+
+    pleiadesLinkObserved_element = ET.SubElement(root, 'pleiadesLinkObserved')
+    pleiadesLinkObserved_element.text = pleiadesLinkObserved
+
+    dateObserved_element = ET.SubElement(root, 'dateObserved')
+    dateObserved_element.text = dateObserved
+
+    datingCriteriaObserved_element = ET.SubElement(root, 'datingCriteriaObserved')
+    datingCriteriaObserved_element.text = datingCriteriaObserved
+
+    provenanceOtherLocations_element = ET.SubElement(root, 'provenanceOtherLocations')
+    provenanceOtherLocations_element.text = provenanceOtherLocations
+
+    geographic_coordinatesOther_element = ET.SubElement(root, "geographicCoordinatesOther")
+
+    latitudeOther_element = ET.SubElement(geographic_coordinatesOther_element, "latitudeOther")
+    latitudeOther_element.text = latitudeOther
+
+    longitudeOther_element = ET.SubElement(geographic_coordinatesOther_element, "longitudeOther")
+    longitudeOther_element.text = longitudeOther
+
+    geonamesLinkOtherLocations_element = ET.SubElement(root, 'geonamesLinkOtherLocations')
+    geonamesLinkOtherLocations_element.text = geonamesLinkOtherLocations
+
+    dateOtherLocations_element = ET.SubElement(root, 'dateOtherLocations')
+    dateOtherLocations_element.text = dateOtherLocations
+
+    datingCriteriaOtherLocations_element = ET.SubElement(root, 'datingCriteriaOtherLocations')
+    datingCriteriaOtherLocations_element.text = datingCriteriaOtherLocations
+
+    currentLocationElem = ET.SubElement(root, 'currentLocation')
+    currentLocationElem.text = currentLocation
+
+    geographicCoordinatesCurrent_element = ET.SubElement(root, 'geographicCoordinatesCurrent')
+
+    latitudeCurrent_element = ET.SubElement(geographicCoordinatesCurrent_element, 'latitudeCurrent')
+    latitudeCurrent_element.text = latitudeCurrent
+
+    longitudeCurrent_element = ET.SubElement(geographicCoordinatesCurrent_element, 'longitudeCurrent')
+    longitudeCurrent_element.text = longitudeCurrent
+
+    geonamesLinkCurrent_element = ET.SubElement(root, 'geonamesLinkCurrent')
+    geonamesLinkCurrent_element.text = geonamesLinkCurrent
+
+    pleiadesLinkCurrent_element = ET.SubElement(root, 'pleiadesLinkCurrent')
+    pleiadesLinkCurrent_element.text = pleiadesLinkCurrent
+
+     # Extract the selected categories and their subcategories
+    selected_categories = form.getlist('categories[]')
+
+    # Create a dictionary to map category names to their respective subcategories
+    category_subcategory_mapping = {
+        "communication":form.getlist('communication_subcategories[]'),
+        "religious": form.getlist('religious_subcategories[]'),
+        "inscriptions": form.getlist('inscriptions_subcategories[]'),
+        "fortifications": form.getlist('fortifications_subcategories[]'),
+        "settlements": form.getlist('settlements_subcategories[]'),
+        "linear":form.getlist('linear_subcategories[]'),
+        "manuscripts": form.getlist('manuscript_subcategories[]'),
+        "water": form.getlist('water_subcategories[]'),
+        "economy": form.getlist('economy_subcategories[]'),
+        "other": form.getlist('other_subcategories[]'),
+        "burials": form.getlist('burials_subcategories[]'),
+        # Add more category-subcategory mappings as needed
+    }
+
+    # Iterate through selected categories and generate XML elements for subcategories
+    for category_name in selected_categories:
+        if category_name in category_subcategory_mapping:
+            subcategories = category_subcategory_mapping[category_name]
+
+            # Wrap the subcategories in <desc type="category"> and <list type="subcategory">
+            category_element = ET.Element("desc", type="category")
+            list_element = ET.Element("list", type=category_name)
+
+            for subcategory in subcategories:
+                item_element = ET.Element("item")
+                item_element.text = subcategory
+                list_element.append(item_element)
+
+            category_element.append(list_element)
+            root.append(category_element)
+        else:
+            # This is a category with no subcategories, wrap it in <desc type="category">
+            category_element = ET.Element("desc", type="category")
+            category_element.text = category_name
+            root.append(category_element)
+
+    authorPublication_element = ET.SubElement(root,'authorPublication')
+    authorPublication_element.text = authorPublication
+
+    informationDates_element = ET.SubElement(root, 'informationDates')
+
+    startDate_element = ET.SubElement(informationDates_element, 'startDate')
+    startDate_element.text = startDate
+    endDate_element = ET.SubElement(informationDates_element, 'endDate')
+    endDate_element.text = endDate
+
+    age_contemporary_element=ET.SubElement(root, 'ageContemporary')
+    age_contemporary_element.text = ageContemporary
+
+    originalLanguage_element= ET.SubElement(root, 'originalLanguage', {'xml:lang': originalLanguage})        
+    originalLanguage_element.text = originalLanguage
+
+    publicationLanguage_element = ET.SubElement(root, 'publicationLanguage', {'xml:lang': publicationLanguage})
+    publicationLanguage_element.text = publicationLanguage
+
+    sourceInformation_element = ET.SubElement(root, 'sourceInformation')
+    sourceInformation_element.text = sourceInformation
+
+    annotation_element= ET.SubElement(root, 'annotation')
+    annotation_element.text = annotation
+
+    keywords_element = ET.SubElement(root, 'keywords')
+    keywords_element.text = keywords
+
+    sourceContent_element = ET.SubElement(root, 'sourceContent')
+    sourceContent_element.text = sourceContent
+
+    copyrightStoragePlace_element = ET.SubElement(root, 'copyrightStoragePlace')
+    copyrightStoragePlace_element.text = copyrightStoragePlace
+
+    viaf_element = ET.SubElement(root, 'viaf')
+    viaf_element.text = viaf
+
+    iiif_element = ET.SubElement(root, 'iiif')
+    iiif_element.text = iiif
+
+    # Serialise
+    xml_string = ET.tostring(root, encoding='utf-8')
+    xml_pretty = xml.dom.minidom.parseString(xml_string).toprettyxml(indent='    ')
+    return xml_pretty
+
+
+def schema_serialise(form):
+    selected_categories = form.getlist('categories[]')
+    categories = [
+        (name, form.getlist(SUBCATEGORY_FIELDS[name]) if name in SUBCATEGORY_FIELDS else None)
+        for name in selected_categories
+    ]
+    return build_site_xml(form, categories)
+
+
+def form_fields(schema=SITE_OBJECT_SCHEMA):
+    for kind, tag, source in schema:
+        if kind == GROUP:
+            yield from form_fields(source)
+        elif kind in (TEXT, LANGUAGE):
+            yield source
+
+
+ALPHABET = string.ascii_letters + string.digits + ' .,;:-_/&<>"\'\r\n\tΘΔαβЖжŞşİıÖüé'
+
+
+def random_text(rng):
+    choice = rng.random()
+    if choice < 0.3:
+        return ''
+    if choice < 0.35:
+        return None
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 40)))
+
+
+def random_form(rng):
+    form = FakeForm()
+    for field in form_fields():
+        value = random_text(rng)
+        if value is not None:
+            form[field] = value
+    for field in ('originalLanguage', 'publicationLanguage'):
+        form[field] = rng.choice(['eng', 'bul', 'ell', 'ota', ''])
+    names = list(SUBCATEGORY_FIELDS) + ['linear_structures', 'a&b']
+    form['categories[]'] = rng.sample(names, rng.randint(0, 4))
+    for name in form['categories[]']:
+        if name in SUBCATEGORY_FIELDS and rng.random() < 0.7:
+            form[SUBCATEGORY_FIELDS[name]] = [random_text(rng) or '' for _ in range(rng.randint(0, 3))]
+    return form
+
+
+def measure(serialise, forms):
+    start = time.process_time()
+    for form in forms:
+        serialise(form)
+    cpu = (time.process_time() - start) / len(forms)
+
+    tracemalloc.start()
+    for form in forms[:200]:
+        tracemalloc.reset_peak()
+        serialise(form)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    forms = [random_form(rng) for _ in range(args.iterations)]
+    for form in forms:
+        expected = legacy_serialise(form)
+        actual = schema_serialise(form)
+        if expected != actual:
+            sys.exit(f"Output differs for {dict(form)!r}:\n{expected}\n---\n{actual}")
+    print(f"{len(forms)} randomised forms serialise byte-identically")
+
+    for name, serialise in (('minidom round trip', legacy_serialise), ('schema writer', schema_serialise)):
+        cpu, peak = measure(serialise, forms)
+        print(f"{name:20} {cpu * 1e6:8.1f} us CPU/submission  {peak / 1024:8.1f} KiB peak allocation")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Synthetic siteObject corpora modelled on uploads/demo.xml.
+
+    python benchmarks/corpus.py 10000 /tmp/corpus/uploads
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from site_xml import build_site_xml  # noqa: E402
+
+SYLLABLES = ['sta', 'ra', 'za', 'go', 'es', 'ki', 'sa', 'gra', 'plov', 'div', 'fi', 'lip', 'po', 'lis',
+             'tar', 'no', 'vo', 'ni', 'ko', 'pol', 'sve', 'ti', 'kas', 'tro', 'hi', 'sar', 'Şe', 'hir', 'köy']
+WORDS = ['capital', 'column', 'inscription', 'church', 'bridge', 'road', 'fortress', 'monastery', 'village',
+         'ruins', 'Greek', 'Latin', 'Ottoman', 'traveller', 'stone', 'tomb', 'fountain', 'inn', 'river', 'hill']
+AUTHORS = ['William Macmichael', 'Ami Boué', 'Felix Kanitz', 'Konstantin Jireček', 'Evliya Çelebi', 'Demo']
+CATEGORIES = {
+    'communication': ['inn', 'bridge', 'ford', 'postStation'],
+    'religious': ['church', 'mosque', 'monastery', 'chapel'],
+    'inscriptions': ['funerary_inscription', 'milestone', 'votive_inscription'],
+    'fortifications': ['fortress', 'watchtower'],
+    'settlements': ['town', 'village', 'mahalla'],
+}
+AGES = ['prehistory', 'iron_age', 'roman_age', 'late_antiquity', 'middle_ages', 'ottoman_period']
+LANGUAGES = ['eng', 'bul', 'ell', 'deu', 'fre', 'ota', 'tur', 'rus']
+DATING_CRITERIA = ['lettering', 'nomenclature', 'prosopography', 'reign', 'internal-date', 'context']
+
+
+def name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def coordinate(rng, low, high):
+    return f"{rng.uniform(low, high):.5f}"
+
+
+def site_form(rng):
+    form = {
+        'author': rng.choice(AUTHORS),
+        'name_source': name(rng),
+        'name_contemporary': name(rng),
+        'description': sentence(rng, rng.randint(8, 30)),
+        'latitude': coordinate(rng, 39.5, 46.0),
+        'longitude': coordinate(rng, 19.5, 29.5),
+        'geonamesLink': f"https://www.geonames.org/{rng.randint(100000, 999999)}/",
+        'date': f"{rng.randint(1, 28):02}.{rng.randint(1, 12):02}.{rng.randint(1700, 1900)}",
+        'datingCriteria': rng.choice(DATING_CRITERIA),
+        'localizationCertainity': rng.choice(['high', 'medium', 'low']),
+        'age': rng.choice(AGES),
+        'ageContemporary': rng.choice(AGES),
+        'authorPublication': rng.choice(AUTHORS),
+        'originalLanguage': rng.choice(LANGUAGES),
+        'publicationLanguage': rng.choice(LANGUAGES),
+        'sourceInformation': f"{rng.choice(AUTHORS)}. {sentence(rng, 6)} London, {rng.randint(1800, 1900)}.",
+        'annotation': sentence(rng, 10),
+        'keywords': ', '.join(rng.sample(WORDS, 5)),
+        'sourceContent': ' '.join(sentence(rng, 15) for _ in range(rng.randint(1, 6))),
+    }
+    if rng.random() < 0.3:
+        form['latitudeCurrent'] = coordinate(rng, 39.5, 46.0)
+        form['longitudeCurrent'] = coordinate(rng, 19.5, 29.5)
+    categories = [
+        (category, rng.sample(subcategories, rng.randint(0, 2)))
+        for category, subcategories in rng.sample(sorted(CATEGORIES.items()), rng.randint(1, 2))
+    ]
+    return form, categories
+
+
+def site_xml(rng):
+    form, categories = site_form(rng)
+    return build_site_xml(form, categories)
+
+
+def generate(folder, count, seed=0):
+    """Write `count` site_NNNNNN.xml files to `folder`."""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for number in range(count):
+        with open(os.path.join(folder, f"site_{number:06}.xml"), 'w', encoding='utf-8') as xml_file:
+            xml_file.write(site_xml(rng))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('count', type=int)
+    parser.add_argument('folder')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.folder, args.count, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import multiprocessing
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+
+from werkzeug.utils import secure_filename
+
+from site_schema import validate_site_values
+from site_xml import build_site_xml, read_site_values
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def iter_sources(fileobj, name):
+    """Yield (source name, binary stream) for every XML document in a ZIP, tar or plain XML upload."""
+    lower_name = name.lower()
+    if lower_name.endswith('.zip'):
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith('.xml'):
+                    with archive.open(info) as member:
+                        yield info.filename, member
+    elif lower_name.endswith(TAR_SUFFIXES):
+        # Stream mode reads the archive front to back without seeking.
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for info in archive:
+                if info.isfile() and info.name.lower().endswith('.xml'):
+                    member = archive.extractfile(info)
+                    yield info.name, member
+    else:
+        yield name, fileobj
+
+
+def iter_site_objects(stream, source):
+    """Yield (source, record filename, XML bytes) for each <siteObject> in `stream`.
+
+    Elements are cleared as soon as they are serialised, so a multi-record
+    file is never held in memory as a whole. A file whose root is a single
+    siteObject keeps its own name; records of a multi-record file are named
+    after their `filename` attribute or numbered after the file.
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    # The open elements, innermost last, so a record can be detached from its parent.
+    parents = []
+    count = 0
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag != 'siteObject':
+            continue
+        count += 1
+        if not parents:
+            filename = os.path.basename(source)
+        else:
+            filename = element.get('filename') or f"{stem}_{count}"
+        yield source, filename, ET.tostring(element, encoding='utf-8')
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+    if count == 0:
+        yield source, None, ValueError("No <siteObject> element found")
+
+
+def iter_records(fileobj, name):
+    for source, stream in iter_sources(fileobj, name):
+        try:
+            yield from iter_site_objects(stream, source)
+        except ET.ParseError as e:
+            yield source, None, ValueError(f"Not well-formed XML: {e}")
+        except (OSError, EOFError, zipfile.BadZipFile, zlib.error) as e:
+            # A damaged member; the rest of the archive may still be readable.
+            yield source, None, ValueError(f"Cannot read {source}: {e}")
+
+
+def normalise_record(record):
+    """Validate one record and rewrite it in the canonical layout; runs in a worker process."""
+    source, filename, content = record
+    report = {'source': source, 'filename': filename, 'status': 'invalid', 'errors': []}
+    if isinstance(content, Exception):
+        report['errors'].append(str(content))
+        return report, None
+
+    filename = secure_filename(filename or '')
+    if not filename:
+        report['errors'].append("Record has no usable filename")
+        return report, None
+    if not filename.endswith('.xml'):
+        filename += '.xml'
+    report['filename'] = filename
+
+    try:
+        root = ET.fromstring(content)
+        values, categories = read_site_values(root)
+        # Older records often leave out fields the form now requires, so only
+        # their values are checked: choices, categories and coordinates.
+        report['errors'].extend(validate_site_values(values, categories, required=False))
+        normalised = build_site_xml(values, categories).encode('utf-8')
+    except (ET.ParseError, ValueError) as e:
+        report['errors'].append(str(e))
+    if report['errors']:
+        return report, None
+    report['status'] = 'imported'
+    return report, normalised
+
+
+def _executor(workers):
+    # One pool per process and size, shared by every import. Its workers are
+    # spawned rather than forked: forking a threaded web worker can copy locks
+    # that its other threads hold.
+    with _executors_lock:
+        pid, executor = _executors.get(workers, (None, None))
+        if pid != os.getpid():
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _executors[workers] = (os.getpid(), executor)
+        return executor
+
+
+def _discard_executor(workers, executor):
+    with _executors_lock:
+        if _executors.get(workers, (None, None))[1] is executor:
+            del _executors[workers]
+    executor.shutdown(wait=False)
+
+
+def import_records(fileobj, name, store, workers=None, batch_size=256, overwrite=False):
+    """Import every siteObject of an upload and yield a report dict per record.
+
+    Records are validated and normalised `batch_size` at a time in a process
+    pool shared by every import of the calling process, so at most one batch
+    is held in memory, and each valid record is passed to
+    `store(filename, content, overwrite)` as its batch completes. `workers=0`
+    processes everything in the calling process.
+
+    Unless `overwrite` is true, a record whose filename is already stored is
+    reported as a 'conflict' rather than replacing it (`store` raises
+    FileExistsError). A record named like an earlier one of the same import
+    is always a conflict.
+    """
+    records = iter_records(fileobj, name)
+    imported = set()
+    executor = _executor(workers) if workers != 0 else None
+    try:
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            if executor is None:
+                results = map(normalise_record, batch)
+            else:
+                results = executor.map(normalise_record, batch, chunksize=max(1, batch_size // 16))
+            for report, content in results:
+                if content is not None and report['filename'] in imported:
+                    report['status'] = 'conflict'
+                    report['errors'].append(f"Another record of this import is also named {report['filename']}")
+                elif content is not None:
+                    try:
+                        store(report['filename'], content, overwrite)
+                    except FileExistsError:
+                        report['status'] = 'conflict'
+                        report['errors'].append(f"A record named {report['filename']} already exists")
+                    except OSError as e:
+                        report['status'] = 'failed'
+                        report['errors'].append(str(e))
+                    else:
+                        imported.add(report['filename'])
+                yield report
+    except BrokenProcessPool:
+        # A worker died; the next import starts a fresh pool.
+        _discard_executor(workers, executor)
+        raise
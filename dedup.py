@@ -0,0 +1,187 @@
+import hashlib
+import math
+import re
+import threading
+from functools import lru_cache
+
+from search_index import fold
+from spatial_index import haversine_km, site_points
+
+NAME_FIELDS = ('nameSource', 'nameContemporary')
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+BANDS = 16  # 4 rows per band: pairs with a Jaccard similarity of about 0.5 and up collide
+
+# A candidate either has a similar name and lies within MAX_DISTANCE_KM (or
+# has no coordinates to compare), or lies within NEAR_DISTANCE_KM and has at
+# least a somewhat similar name.
+NAME_THRESHOLD = 0.5
+MAX_DISTANCE_KM = 25.0
+NEAR_DISTANCE_KM = 0.5
+NEAR_NAME_THRESHOLD = 0.2
+# Points further apart in latitude than this are further apart than MAX_DISTANCE_KM.
+MAX_LATITUDE_DELTA = math.degrees(MAX_DISTANCE_KM / 6371.0088)
+
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def shingles(name):
+    """Character trigrams of a folded name, with spaces marking the word boundaries."""
+    normalised = ' ' + NON_WORD_RE.sub(' ', fold(name)).strip() + ' '
+    if len(normalised) <= 2:
+        return frozenset()
+    return frozenset(normalised[i:i + SHINGLE_SIZE] for i in range(max(1, len(normalised) - SHINGLE_SIZE + 1)))
+
+
+@lru_cache(maxsize=65536)
+def _shingle_hashes(shingle):
+    # NUM_PERMUTATIONS independent 32-bit hashes from one SHAKE digest.
+    return memoryview(hashlib.shake_128(shingle.encode('utf-8')).digest(4 * NUM_PERMUTATIONS)).cast('I').tolist()
+
+
+def minhash(shingle_set):
+    return list(map(min, zip(*map(_shingle_hashes, shingle_set))))
+
+
+def band_keys(signature):
+    rows = NUM_PERMUTATIONS // BANDS
+    return [hash((band,) + tuple(signature[band * rows:(band + 1) * rows])) for band in range(BANDS)]
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def record_keys(names, points):
+    """The (shingle sets, band keys, points) a record is compared and bucketed by."""
+    shingle_sets = [shingle_set for shingle_set in {shingles(name) for name in names if name} if shingle_set]
+    keys = set()
+    for shingle_set in shingle_sets:
+        keys.update(band_keys(minhash(shingle_set)))
+    return shingle_sets, keys, list(points)
+
+
+def _is_candidate(similarity, distance):
+    if distance is not None and distance <= NEAR_DISTANCE_KM:
+        return similarity >= NEAR_NAME_THRESHOLD
+    return similarity >= NAME_THRESHOLD and (distance is None or distance <= MAX_DISTANCE_KM)
+
+
+class DuplicateIndex:
+    """Finds records that probably describe the same site as another.
+
+    Names (nameSource and nameContemporary) are compared by the Jaccard
+    similarity of their character trigrams. MinHash signatures bucketed by
+    LSH bands find records with similar names without comparing against the
+    whole archive, and `spatial_index` (a SpatialIndex) adds the records
+    within NEAR_DISTANCE_KM. Each candidate is then scored exactly.
+    """
+
+    def __init__(self, spatial_index):
+        self.spatial_index = spatial_index
+        self._records = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def update(self, filename, site_object):
+        """Index `site_object` under `filename`, replacing any previous version; None removes it."""
+        keys = None
+        if site_object is not None:
+            keys = record_keys((site_object.get(field) for field in NAME_FIELDS), site_points(site_object))
+        with self._lock:
+            previous = self._records.pop(filename, None)
+            if previous is not None:
+                for key in previous[1]:
+                    bucket = self._buckets[key]
+                    bucket.discard(filename)
+                    if not bucket:
+                        del self._buckets[key]
+            if keys is None:
+                return
+            self._records[filename] = keys
+            for key in keys[1]:
+                self._buckets.setdefault(key, set()).add(filename)
+
+    def candidates(self, names, points, exclude=None, limit=10):
+        """Likely duplicates of a record with these names and (kind, latitude, longitude) points.
+
+        Returns dicts with the filename, the name similarity (0-1) and the
+        distance in km between the closest points (None without coordinates),
+        most similar first.
+        """
+        return self._candidates(record_keys(names, points), exclude, limit)
+
+    def duplicates_of(self, filename, limit=10):
+        keys = self._records.get(filename)
+        return self._candidates(keys, filename, limit) if keys is not None else []
+
+    def _candidates(self, keys, exclude, limit):
+        results = [
+            {
+                'filename': candidate,
+                'name_similarity': round(similarity, 3),
+                'distance_km': None if distance is None else round(distance, 3),
+            }
+            for candidate, similarity, distance in self._matches(keys, exclude)
+        ]
+        results.sort(key=lambda result: (-result['name_similarity'], result['distance_km'] or 0.0, result['filename']))
+        return results[:limit]
+
+    def _matches(self, keys, exclude, after=None):
+        # (filename, similarity, distance) of every candidate, skipping the
+        # filenames up to `after` so batch mode scores each pair only once.
+        shingle_sets, band_keys_, points = keys
+        with self._lock:
+            found = set()
+            for key in band_keys_:
+                found.update(self._buckets.get(key, ()))
+            for _, latitude, longitude in points:
+                found.update(match[1] for match in self.spatial_index.near(latitude, longitude, NEAR_DISTANCE_KM))
+            found.discard(exclude)
+            records = self._records
+            matches = []
+            for candidate in found:
+                other = records.get(candidate)
+                if other is None or (after is not None and candidate <= after):
+                    continue
+                if points and other[2] and all(
+                    abs(lat1 - lat2) > MAX_LATITUDE_DELTA for _, lat1, _ in points for _, lat2, _ in other[2]
+                ):
+                    continue
+                similarity = max(
+                    (jaccard(first, second) for first in shingle_sets for second in other[0]), default=0.0
+                )
+                if similarity < NEAR_NAME_THRESHOLD:
+                    continue
+                distance = min(
+                    (haversine_km(lat1, lon1, lat2, lon2) for _, lat1, lon1 in points for _, lat2, lon2 in other[2]),
+                    default=None
+                )
+                if _is_candidate(similarity, distance):
+                    matches.append((candidate, similarity, distance))
+        return matches
+
+    def clusters(self):
+        """Groups of two or more records that are linked by likely-duplicate pairs, largest first."""
+        parents = {}
+
+        def root(filename):
+            parents.setdefault(filename, filename)
+            while parents[filename] != filename:
+                parents[filename] = parents[parents[filename]]
+                filename = parents[filename]
+            return filename
+
+        for filename, keys in list(self._records.items()):
+            for candidate, _, _ in self._matches(keys, filename, after=filename):
+                first, second = root(filename), root(candidate)
+                if first != second:
+                    parents[max(first, second)] = min(first, second)
+
+        groups = {}
+        for filename in parents:
+            groups.setdefault(root(filename), []).append(filename)
+        return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=lambda group: (-len(group), group))
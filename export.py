@@ -0,0 +1,219 @@
+"""Streaming exports of flattened siteObject records.
+
+Every writer takes an iterable of (filename, site_object) pairs and yields
+encoded chunks of roughly CHUNK_SIZE bytes, so an export of the whole corpus
+is sent or written as it is produced and never held in memory.
+"""
+import csv
+import io
+import json
+import struct
+import zlib
+
+from site_xml import CATEGORIES, GROUP, SITE_OBJECT_SCHEMA
+from spatial_index import site_points
+
+CHUNK_SIZE = 64 * 1024
+ROW_GROUP_SIZE = 4096
+
+COLUMNAR_MAGIC = b'DSEECOL1'
+_NULL = 0xFFFFFFFF
+_PLAIN = 0
+_DICTIONARY = 1
+
+
+def export_columns():
+    """Flattened field names in document order, preceded by the filename."""
+    columns = ['filename']
+    for kind, tag, fields in SITE_OBJECT_SCHEMA:
+        if kind == GROUP:
+            columns.extend(child_tag for _, child_tag, _ in fields)
+        elif kind == CATEGORIES:
+            columns.extend(['category', 'subcategory'])
+        else:
+            columns.append(tag)
+    return columns
+
+
+COLUMNS = export_columns()
+
+
+def _chunked(pieces):
+    # Join small encoded pieces into chunks of about CHUNK_SIZE bytes.
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _row(filename, site_object):
+    return [filename] + [site_object.get(column) for column in COLUMNS[1:]]
+
+
+def write_csv(records):
+    def pieces():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        for filename, site_object in records:
+            writer.writerow(_row(filename, site_object))
+            if buffer.tell() >= CHUNK_SIZE:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+    return _chunked(pieces())
+
+
+def write_ndjson(records):
+    return _chunked(
+        (json.dumps(dict(zip(COLUMNS, _row(filename, site_object))), ensure_ascii=False) + '\n').encode('utf-8')
+        for filename, site_object in records
+    )
+
+
+def write_geojson(records):
+    """A FeatureCollection with one Point per coordinate group of every record."""
+    def pieces():
+        yield b'{"type":"FeatureCollection","features":['
+        separator = b''
+        for filename, site_object in records:
+            properties = dict(zip(COLUMNS, _row(filename, site_object)))
+            for kind, latitude, longitude in site_points(site_object):
+                feature = {
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                    'properties': dict(properties, kind=kind),
+                }
+                yield separator + json.dumps(feature, ensure_ascii=False).encode('utf-8')
+                separator = b','
+        yield b']}\n'
+    return _chunked(pieces())
+
+
+_NULL_LENGTH = struct.pack('<I', _NULL)
+_pack_length = struct.Struct('<I').pack
+
+
+def _encode_strings(values):
+    pieces = []
+    for value in values:
+        if value is None:
+            pieces.append(_NULL_LENGTH)
+        else:
+            encoded = value.encode('utf-8')
+            pieces.append(_pack_length(len(encoded)))
+            pieces.append(encoded)
+    return b''.join(pieces)
+
+
+def _encode_column(values):
+    # Low-cardinality columns (ages, languages, authors...) are dictionary
+    # encoded with the smallest index width that fits.
+    distinct = {}
+    for value in values:
+        distinct.setdefault(value, len(distinct))
+    if len(distinct) > len(values) // 2 or len(distinct) > 0xFFFF:
+        return bytes([_PLAIN]) + _encode_strings(values)
+    index_type = 'B' if len(distinct) <= 0xFF else 'H'
+    return (
+        bytes([_DICTIONARY, struct.calcsize(index_type)])
+        + struct.pack('<I', len(distinct))
+        + _encode_strings(distinct)
+        + struct.pack(f'<{len(values)}{index_type}', *(distinct[value] for value in values))
+    )
+
+
+def write_columnar(records, row_group_size=ROW_GROUP_SIZE):
+    """Column-oriented binary export, see read_columnar for the layout.
+
+    Records are buffered in row groups of `row_group_size`; within a group
+    every column is stored contiguously and the group is zlib-compressed.
+    """
+    header = json.dumps({'columns': COLUMNS}).encode('utf-8')
+    yield COLUMNAR_MAGIC + struct.pack('<I', len(header)) + header
+
+    def row_group(rows):
+        payload = struct.pack('<I', len(rows)) + b''.join(
+            _encode_column([row[position] for row in rows]) for position in range(len(COLUMNS))
+        )
+        compressed = zlib.compress(payload, 1)
+        return struct.pack('<I', len(compressed)) + compressed
+
+    rows = []
+    for filename, site_object in records:
+        rows.append(_row(filename, site_object))
+        if len(rows) == row_group_size:
+            yield row_group(rows)
+            rows = []
+    if rows:
+        yield row_group(rows)
+    yield struct.pack('<I', 0)
+
+
+def _read_strings(payload, offset, count):
+    values = []
+    for _ in range(count):
+        (length,) = struct.unpack_from('<I', payload, offset)
+        offset += 4
+        if length == _NULL:
+            values.append(None)
+        else:
+            values.append(payload[offset:offset + length].decode('utf-8'))
+            offset += length
+    return values, offset
+
+
+def read_columnar(fileobj):
+    """Yield the records of a columnar export as {column: value} dicts.
+
+    Layout: magic, u32 header length, JSON header with the column names, then
+    row groups of u32 compressed length + zlib(u32 row count, columns), ending
+    with a zero length. A column is either plain (u8 0, strings) or dictionary
+    encoded (u8 1, u8 index width, u32 size, strings, indices). Strings are a
+    u32 byte length (0xFFFFFFFF for null) followed by UTF-8. Integers are
+    little-endian.
+    """
+    if fileobj.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("not a columnar export")
+    (length,) = struct.unpack('<I', fileobj.read(4))
+    columns = json.loads(fileobj.read(length))['columns']
+    while True:
+        (length,) = struct.unpack('<I', fileobj.read(4))
+        if not length:
+            return
+        payload = zlib.decompress(fileobj.read(length))
+        (count,) = struct.unpack_from('<I', payload)
+        offset = 4
+        data = []
+        for _ in columns:
+            encoding = payload[offset]
+            offset += 1
+            if encoding == _PLAIN:
+                values, offset = _read_strings(payload, offset, count)
+            else:
+                width = payload[offset]
+                (size,) = struct.unpack_from('<I', payload, offset + 1)
+                dictionary, offset = _read_strings(payload, offset + 5, size)
+                index_type = 'B' if width == 1 else 'H'
+                values = [dictionary[index] for index in struct.unpack_from(f'<{count}{index_type}', payload, offset)]
+                offset += count * width
+            data.append(values)
+        for row in zip(*data):
+            yield dict(zip(columns, row))
+
+
+# Format name -> (writer, mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': (write_csv, 'text/csv', 'csv'),
+    'ndjson': (write_ndjson, 'application/x-ndjson', 'ndjson'),
+    'geojson': (write_geojson, 'application/geo+json', 'geojson'),
+    'columnar': (write_columnar, 'application/octet-stream', 'dseecol'),
+}
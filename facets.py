@@ -0,0 +1,143 @@
+import threading
+
+
+def _split(value):
+    return value.split() if value else []
+
+
+def default_extractors(language_codes):
+    """Facet name -> function returning the facet values of a flattened siteObject.
+
+    `language_codes` maps language names to their codes, so older records that
+    store 'English' count towards 'eng' like newer ones.
+    """
+    def values(*fields):
+        return lambda site_object: [site_object.get(field) for field in fields]
+
+    def languages(site_object):
+        for field in ('originalLanguage', 'publicationLanguage'):
+            value = site_object.get(field)
+            if value:
+                yield language_codes.get(value.strip(), value.strip())
+
+    return {
+        'category': lambda site_object: _split(site_object.get('category')),
+        'subcategory': lambda site_object: _split(site_object.get('subcategory')),
+        'age': values('age', 'ageContemporary'),
+        'dating_criteria': values('datingCriteria', 'datingCriteriaObserved', 'datingCriteriaOtherLocations'),
+        'language': languages,
+    }
+
+
+def _bits(bitmap):
+    # Positions of the set bits, lowest first.
+    digits = bin(bitmap)[:1:-1]
+    position = digits.find('1')
+    while position != -1:
+        yield position
+        position = digits.find('1', position + 1)
+
+
+class FacetIndex:
+    """Posting bitmaps for every facet value, for filtered listings and facet counts.
+
+    Each record gets a small integer id and every (facet, value) pair keeps a
+    Python int with the bits of the records that have it, so filtering is a
+    handful of ANDs/ORs and a count is int.bit_count().
+    """
+
+    def __init__(self, extractors):
+        self.extractors = extractors
+        self._postings = {name: {} for name in extractors}
+        self._ids = {}
+        self._filenames = []
+        self._free_ids = []
+        self._values = {}
+        self._all = 0
+        self._lock = threading.Lock()
+
+    def update(self, filename, site_object):
+        """Index `site_object` under `filename`, replacing any previous version; None removes it."""
+        with self._lock:
+            record_id = self._ids.get(filename)
+            if record_id is not None:
+                bit = 1 << record_id
+                for name, value in self._values.pop(filename):
+                    postings = self._postings[name]
+                    postings[value] &= ~bit
+                    if not postings[value]:
+                        del postings[value]
+                if site_object is None:
+                    del self._ids[filename]
+                    self._filenames[record_id] = None
+                    self._free_ids.append(record_id)
+                    self._all &= ~bit
+                    return
+            elif site_object is None:
+                return
+            else:
+                if self._free_ids:
+                    record_id = self._free_ids.pop()
+                    self._filenames[record_id] = filename
+                else:
+                    record_id = len(self._filenames)
+                    self._filenames.append(filename)
+                self._ids[filename] = record_id
+                bit = 1 << record_id
+                self._all |= bit
+
+            values = set()
+            for name, extract in self.extractors.items():
+                for value in extract(site_object):
+                    if value:
+                        values.add((name, value))
+            for name, value in values:
+                postings = self._postings[name]
+                postings[value] = postings.get(value, 0) | bit
+            self._values[filename] = values
+
+    def _selection(self, name, values):
+        bitmap = 0
+        for value in values:
+            bitmap |= self._postings[name].get(value, 0)
+        return bitmap
+
+    def _match(self, filters, skip=None):
+        bitmap = self._all
+        for name, values in filters.items():
+            if name != skip and values:
+                bitmap &= self._selection(name, values)
+        return bitmap
+
+    def bitmap(self, filenames):
+        """Bitmap of the given filenames, for restricting counts to e.g. search results."""
+        bits = bytearray((len(self._filenames) + 7) // 8)
+        for filename in filenames:
+            record_id = self._ids.get(filename)
+            if record_id is not None:
+                bits[record_id >> 3] |= 1 << (record_id & 7)
+        return int.from_bytes(bits, 'little')
+
+    def filenames(self, filters, within=None):
+        """Sorted filenames matching `filters` ({facet: [values]}; OR within a facet, AND across facets)."""
+        with self._lock:
+            bitmap = self._match(filters)
+            if within is not None:
+                bitmap &= within
+            return sorted(self._filenames[record_id] for record_id in _bits(bitmap))
+
+    def counts(self, filters, within=None):
+        """{facet: {value: count}} of the records each value would select given the other facets' filters."""
+        with self._lock:
+            counts = {}
+            for name, postings in self._postings.items():
+                # A facet's own selection is ignored so its other values still show how many they would add.
+                base = self._match(filters, skip=name)
+                if within is not None:
+                    base &= within
+                counts[name] = {
+                    value: count
+                    for value, count in ((value, (bitmap & base).bit_count()) for value, bitmap in postings.items())
+                    if count
+                }
+            return counts
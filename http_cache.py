@@ -0,0 +1,58 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/xml', 'text/xml', 'application/json', 'text/plain', 'text/csv'}
+
+
+def negotiate_encoding(accept_encodings):
+    """Best content coding the client accepts ('br' or 'gzip'), or None for identity."""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def representation_etag(digest, encoding):
+    # Each content coding is a different representation and needs its own strong ETag.
+    return f"{digest}-{encoding}" if encoding else digest
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    # mtime=0 keeps the output identical for identical input, as a strong ETag requires.
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+class CompressedCache:
+    """Least recently used compressed bodies, keyed by content digest and coding, up to `max_bytes`."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, digest, encoding, data):
+        key = (digest, encoding)
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                return body
+        body = compress(data, encoding)
+        with self._lock:
+            if key not in self._entries and len(body) <= self.max_bytes:
+                self._entries[key] = body
+                self._size += len(body)
+                while self._size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+        return body
@@ -0,0 +1,153 @@
+import cProfile
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metrics:
+    """Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Everything is a no-op unless `enabled`, so instrumented code paths cost
+    nothing by default. Values are per process; with several workers each one
+    reports its own series.
+    """
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._help = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+            bucket_counts = histogram[0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[position] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def phase(self, route, phase):
+        """Time one phase of a request handler into digitalsee_phase_seconds."""
+        return self.timer('digitalsee_phase_seconds', route=route, phase=phase)
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(value[0]), value[1], value[2]) for key, value in self._histograms.items()}
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            help_kind, help_text = self._help.get(name, (kind, ''))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {help_kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (bucket_counts, count, total) in sorted(histograms.items()):
+            header(name, 'histogram')
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """Runs cProfile on a random sample of requests and keeps the profiles of slow ones.
+
+    Profiles are written to `folder` as <timestamp>-<pid>-<n>-<endpoint>.prof and
+    can be read with `python -m pstats` or snakeviz.
+    """
+
+    def __init__(self, sample_rate, slow_seconds, folder):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.folder = folder
+        self._counter = itertools.count(1)
+
+    def start(self):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread.
+            return None
+        return profile
+
+    def stop(self, profile, endpoint, duration):
+        profile.disable()
+        if duration < self.slow_seconds:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        now = time.time()
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now % 1 * 1000):03d}"
+        # The counter keeps profiles of requests that end in the same millisecond apart.
+        path = os.path.join(self.folder, f"{stamp}-{os.getpid()}-{next(self._counter)}-{endpoint}.prof")
+        profile.dump_stats(path)
+        return path
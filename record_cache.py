@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from site_xml import parse_site_object
+from storage import content_digest
+
+CACHE_VERSION = 4
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(filename, digest):
+    # Per-record share of the corpus generation; XOR-ing them makes it order independent.
+    return int(content_digest(f"{filename}\0{digest}"), 16)
+
+
+class RecordCache:
+    """Parsed siteObject records for every XML file in the upload folder.
+
+    `folder` is a FlatFolder or ShardedFolder (see upload_folder.py). Each
+    entry is keyed on the key the folder reports for its file, such as its
+    (mtime, size, inode), so a refresh only re-parses files that actually
+    changed since the last scan. The entries are persisted to `cache_path`
+    so a restarted worker starts warm; a refresh rewrites that file at most
+    once every `save_interval` seconds. Every entry also keeps the content
+    digest of its file, which serves as its ETag.
+    """
+
+    def __init__(self, folder, cache_path, save_interval=0):
+        self.folder = folder
+        self.cache_path = cache_path
+        self.save_interval = save_interval
+        self._saved_at = 0.0
+        self._entries = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        # Serialises refresh() and refresh_files(), which may run in a watcher thread.
+        self._scan_lock = threading.Lock()
+        self._dirty = False
+        self._sorted = None
+        self._broken = {}
+        self._refreshed_at = 0.0
+        self._generation = 0
+        self._read_seconds = self._parse_seconds = 0.0
+        self._scanned = None
+        # Optional observe_phase(phase, seconds) callback for the listdir/read/parse split of a refresh.
+        self.observe_phase = None
+        self.load()
+
+    def subscribe(self, listener):
+        """Register `listener(filename, site_object)`; `site_object` is None on removal."""
+        self._listeners.append(listener)
+        for filename, (_, site_object, _) in list(self._entries.items()):
+            listener(filename, site_object)
+
+    def _notify(self, filename, site_object):
+        for listener in self._listeners:
+            listener(filename, site_object)
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != CACHE_VERSION:
+            return
+        self._entries = {
+            filename: (tuple(key), site_object, digest)
+            for filename, (key, site_object, digest) in data['entries'].items()
+        }
+        self._generation = 0
+        for filename, (_, _, digest) in self._entries.items():
+            self._generation ^= _fingerprint(filename, digest)
+        self._saved_at = time.monotonic()
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'version': CACHE_VERSION,
+                'entries': {
+                    filename: [list(key), site_object, digest]
+                    for filename, (key, site_object, digest) in self._entries.items()
+                },
+            }
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            # dumps() uses the C encoder; dump() streams through the much slower pure Python one.
+            cache_file.write(json.dumps(data, ensure_ascii=False))
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self):
+        """Bring the cache in line with the upload folder."""
+        with self._scan_lock:
+            self._refresh()
+
+    def _refresh(self):
+        self._refreshed_at = time.monotonic()
+        started = time.perf_counter()
+        self._read_seconds = self._parse_seconds = 0.0
+        seen = self.folder.scan()
+        if seen is self._scanned:
+            # The folder handed back the same listing: nothing changed since the last refresh.
+            return
+        changed = []
+        for filename, key in seen.items():
+            cached = self._entries.get(filename)
+            if cached is not None and cached[0] == key:
+                continue
+            if self._broken.get(filename) == key:
+                continue
+            parsed = self._parse_file(self.folder.path(filename), filename, key)
+            if parsed is not None:
+                changed.append((filename, key) + parsed)
+        if self.observe_phase is not None:
+            elapsed = time.perf_counter() - started
+            self.observe_phase('listdir', elapsed - self._read_seconds - self._parse_seconds)
+            self.observe_phase('read', self._read_seconds)
+            self.observe_phase('parse', self._parse_seconds)
+
+        with self._lock:
+            # Files that became unreadable are dropped like deleted ones.
+            removed = [filename for filename in self._entries if filename not in seen or filename in self._broken]
+            for filename in removed:
+                self._remove(filename)
+            for filename in [filename for filename in self._broken if filename not in seen]:
+                del self._broken[filename]
+            for filename, key, site_object, digest in changed:
+                self._store(filename, key, site_object, digest)
+            if removed or changed:
+                self._dirty = True
+                self._sorted = None
+
+        for filename in removed:
+            self._notify(filename, None)
+        for filename, _, site_object, _ in changed:
+            self._notify(filename, site_object)
+        self._scanned = seen
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def _store(self, filename, key, site_object, digest):
+        self._remove(filename)
+        self._entries[filename] = (key, site_object, digest)
+        self._generation ^= _fingerprint(filename, digest)
+
+    def _remove(self, filename):
+        cached = self._entries.pop(filename, None)
+        if cached is not None:
+            self._generation ^= _fingerprint(filename, cached[2])
+        return cached
+
+    def _parse_file(self, path, filename, key):
+        # A single unreadable or malformed file must not take the whole
+        # listing down; it is skipped until its (mtime, size, inode) changes.
+        try:
+            started = time.perf_counter()
+            with open(path, 'rb') as xml_file:
+                content = xml_file.read()
+            read = time.perf_counter()
+            site_object = parse_site_object(content.decode('utf-8'))
+            self._read_seconds += read - started
+            self._parse_seconds += time.perf_counter() - read
+        except FileNotFoundError:
+            return None
+        except (OSError, UnicodeDecodeError, ET.ParseError) as e:
+            logger.warning("Skipping unreadable upload %s: %s", filename, e)
+            self._broken[filename] = key
+            return None
+        self._broken.pop(filename, None)
+        return site_object, content_digest(content)
+
+    def refresh_files(self, filenames):
+        """Bring the entries of just these files in line with the upload folder.
+
+        For a watcher that knows which files changed; a file that is gone or
+        unreadable is dropped, one whose key is unchanged is not read again.
+        Unlike refresh() this does not rewrite the cache file, which would
+        cost more than the update itself; call save() for that.
+        """
+        with self._scan_lock:
+            changed = []
+            gone = []
+            for filename in filenames:
+                key = self.folder.key(filename)
+                if key is None:
+                    self._broken.pop(filename, None)
+                    gone.append(filename)
+                    continue
+                cached = self._entries.get(filename)
+                if (cached is not None and cached[0] == key) or self._broken.get(filename) == key:
+                    continue
+                parsed = self._parse_file(self.folder.path(filename), filename, key)
+                if parsed is None:
+                    gone.append(filename)
+                else:
+                    changed.append((filename, key) + parsed)
+
+            with self._lock:
+                removed = [filename for filename in gone if self._remove(filename) is not None]
+                for filename, key, site_object, digest in changed:
+                    self._store(filename, key, site_object, digest)
+                if removed or changed:
+                    self._dirty = True
+                    self._sorted = None
+
+            for filename in removed:
+                self._notify(filename, None)
+            for filename, _, site_object, _ in changed:
+                self._notify(filename, site_object)
+
+    def refresh_if_stale(self, max_age):
+        """Refresh only if the last scan is more than `max_age` seconds old."""
+        if time.monotonic() - self._refreshed_at > max_age:
+            self.refresh()
+
+    def put(self, filename, content):
+        """Record a file the app has just written, without waiting for the next scan."""
+        key = self.folder.key(filename)
+        try:
+            site_object = parse_site_object(content)
+        except (UnicodeDecodeError, ET.ParseError) as e:
+            logger.warning("Stored upload %s is not valid XML: %s", filename, e)
+            with self._lock:
+                self._broken[filename] = key
+                if self._remove(filename) is not None:
+                    self._sorted = None
+                    self._dirty = True
+            self._notify(filename, None)
+            return None
+        with self._lock:
+            self._broken.pop(filename, None)
+            if filename not in self._entries:
+                self._sorted = None
+            self._store(filename, key, site_object, content_digest(content))
+            self._dirty = True
+        self._notify(filename, site_object)
+        return site_object
+
+    def get(self, filename):
+        cached = self._entries.get(filename)
+        return cached[1] if cached is not None else None
+
+    def etag(self, filename):
+        """Content digest of `filename`, or None if the file changed since it was cached."""
+        cached = self._entries.get(filename)
+        if cached is None:
+            return None
+        return cached[2] if cached[0] == self.folder.key(filename) else None
+
+    def generation(self):
+        """Token that changes whenever any record is written or removed.
+
+        It is derived from the filenames and content digests of all records
+        rather than counted, so every worker that has seen the same files
+        reports the same generation.
+        """
+        return f"{self._generation:032x}"
+
+    def filenames(self):
+        """All cached filenames in sorted order; the list is shared, do not mutate it."""
+        filenames = self._sorted
+        if filenames is None:
+            with self._lock:
+                filenames = self._sorted = sorted(self._entries)
+        return filenames
+
+    def records(self):
+        return {filename: site_object for filename, (_, site_object, _) in self._entries.items()}
@@ -0,0 +1,243 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from site_xml import flatten_site_object, read_site_values
+from storage import content_digest
+
+logger = logging.getLogger(__name__)
+
+# Bump when flatten_site_object changes, so the stored records are rebuilt from their XML.
+RECORD_VERSION = 3
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    filename TEXT PRIMARY KEY,
+    xml BLOB NOT NULL,
+    record TEXT NOT NULL,
+    age TEXT,
+    age_contemporary TEXT,
+    dating_criteria TEXT,
+    digest TEXT,
+    mtime_ns INTEGER,
+    size INTEGER,
+    inode INTEGER
+);
+CREATE INDEX IF NOT EXISTS sites_age ON sites (age);
+CREATE INDEX IF NOT EXISTS sites_age_contemporary ON sites (age_contemporary);
+CREATE INDEX IF NOT EXISTS sites_dating_criteria ON sites (dating_criteria);
+
+CREATE TABLE IF NOT EXISTS site_categories (
+    filename TEXT NOT NULL REFERENCES sites (filename) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    subcategory TEXT
+);
+CREATE INDEX IF NOT EXISTS site_categories_category ON site_categories (category, subcategory);
+CREATE INDEX IF NOT EXISTS site_categories_filename ON site_categories (filename);
+
+CREATE TABLE IF NOT EXISTS site_languages (
+    filename TEXT NOT NULL REFERENCES sites (filename) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    language TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS site_languages_language ON site_languages (language, role);
+CREATE INDEX IF NOT EXISTS site_languages_filename ON site_languages (filename);
+
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL
+);
+"""
+
+def _languages(root):
+    for role, tag in (('original', 'originalLanguage'), ('publication', 'publicationLanguage')):
+        element = root.find(tag)
+        if element is None:
+            continue
+        language = element.get(XML_LANG) or element.text
+        if language:
+            yield role, language
+
+
+class SqliteStore:
+    """siteObject records kept in SQLite, with the original XML stored verbatim.
+
+    Offers the same interface as RecordCache (refresh, put, get, filenames,
+    subscribe) so the app can use either. Categories, subcategories and
+    languages go into indexed side tables for querying the database
+    directly; the app itself filters with its FacetIndex. Every write
+    is appended to a change log that refresh() replays, which keeps the
+    in-memory indexes of all worker processes in step.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._listeners = []
+        self._sorted = None
+        self._last_seq = 0
+        self._refreshed_at = 0.0
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(sites)")]
+            if 'digest' not in columns:
+                connection.execute("ALTER TABLE sites ADD COLUMN digest TEXT")
+            self._last_seq = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self._upgrade_records()
+
+    def _upgrade_records(self):
+        connection = self._connect()
+        if connection.execute("PRAGMA user_version").fetchone()[0] >= RECORD_VERSION:
+            return
+        with connection:
+            rows = connection.execute("SELECT filename, xml FROM sites").fetchall()
+            connection.executemany(
+                "UPDATE sites SET record = ?, digest = ? WHERE filename = ?",
+                [
+                    (
+                        json.dumps(flatten_site_object(ET.fromstring(content)), ensure_ascii=False),
+                        content_digest(content),
+                        filename,
+                    )
+                    for filename, content in rows
+                ]
+            )
+            connection.execute(f"PRAGMA user_version = {RECORD_VERSION}")
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+        for filename, record in self._connect().execute("SELECT filename, record FROM sites"):
+            listener(filename, json.loads(record))
+
+    def _notify(self, filename, site_object):
+        for listener in self._listeners:
+            listener(filename, site_object)
+
+    def refresh(self):
+        """Replay writes made by other processes since the last refresh."""
+        self._refreshed_at = time.monotonic()
+        connection = self._connect()
+        changes = connection.execute(
+            "SELECT MAX(seq), filename FROM changes WHERE seq > ? GROUP BY filename", (self._last_seq,)
+        ).fetchall()
+        if not changes:
+            return
+        self._last_seq = max(seq for seq, _ in changes)
+        self._sorted = None
+        for _, filename in changes:
+            self._notify(filename, self.get(filename))
+
+    def refresh_if_stale(self, max_age):
+        if time.monotonic() - self._refreshed_at > max_age:
+            self.refresh()
+
+    def put(self, filename, content, key=None):
+        """Store `content` (the XML document) under `filename`; `key` is the source file's stat key if any."""
+        try:
+            root = ET.fromstring(content)
+        except ET.ParseError as e:
+            logger.warning("Not storing %s, it is not valid XML: %s", filename, e)
+            return None
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        site_object = flatten_site_object(root)
+        _, categories = read_site_values(root)
+        mtime_ns, size, inode = key or (None, None, None)
+
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM site_categories WHERE filename = ?", (filename,))
+            connection.execute("DELETE FROM site_languages WHERE filename = ?", (filename,))
+            connection.execute(
+                "INSERT OR REPLACE INTO sites "
+                "(filename, xml, record, age, age_contemporary, dating_criteria, digest, mtime_ns, size, inode) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    filename, content, json.dumps(site_object, ensure_ascii=False),
+                    site_object.get('age'), site_object.get('ageContemporary'), site_object.get('datingCriteria'),
+                    content_digest(content), mtime_ns, size, inode,
+                )
+            )
+            connection.executemany(
+                "INSERT INTO site_categories (filename, category, subcategory) VALUES (?, ?, ?)",
+                [
+                    (filename, category, subcategory)
+                    for category, subcategories in categories
+                    for subcategory in (subcategories or [None])
+                ]
+            )
+            connection.executemany(
+                "INSERT INTO site_languages (filename, role, language) VALUES (?, ?, ?)",
+                [(filename, role, language) for role, language in _languages(root)]
+            )
+            seq = connection.execute("INSERT INTO changes (filename) VALUES (?)", (filename,)).lastrowid
+        self._seen(seq)
+        self._notify(filename, site_object)
+        return site_object
+
+    def delete(self, filename):
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM sites WHERE filename = ?", (filename,))
+            seq = connection.execute("INSERT INTO changes (filename) VALUES (?)", (filename,)).lastrowid
+        self._seen(seq)
+        self._notify(filename, None)
+
+    def _seen(self, seq):
+        self._sorted = None
+        # Our own write is already applied; only skip ahead if nothing else happened in between.
+        if seq == self._last_seq + 1:
+            self._last_seq = seq
+
+    def get(self, filename):
+        row = self._connect().execute("SELECT record FROM sites WHERE filename = ?", (filename,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_xml(self, filename):
+        row = self._connect().execute("SELECT xml FROM sites WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def etag(self, filename):
+        """Content digest of the stored XML, without loading it."""
+        row = self._connect().execute("SELECT digest FROM sites WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def generation(self):
+        """Sequence number of the last change applied; the same in every worker after a refresh."""
+        return str(self._last_seq)
+
+    def stat_keys(self):
+        """{filename: (mtime_ns, size, inode)} of records migrated from files, for resuming a migration."""
+        return {
+            filename: (mtime_ns, size, inode)
+            for filename, mtime_ns, size, inode in self._connect().execute(
+                "SELECT filename, mtime_ns, size, inode FROM sites WHERE mtime_ns IS NOT NULL"
+            )
+        }
+
+    def iter_xml(self):
+        yield from self._connect().execute("SELECT filename, xml FROM sites ORDER BY filename")
+
+    def filenames(self):
+        """All filenames in sorted order; the list is shared, do not mutate it."""
+        filenames = self._sorted
+        if filenames is None:
+            filenames = self._sorted = [
+                row[0] for row in self._connect().execute("SELECT filename FROM sites ORDER BY filename")
+            ]
+        return filenames
@@ -0,0 +1,146 @@
+import bisect
+import math
+import re
+import threading
+import unicodedata
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Shorter terms only match whole tokens; expanding one or two letter prefixes
+# would touch most of the index on every keystroke.
+MIN_PREFIX_LENGTH = 3
+
+# Letters that have no Unicode decomposition but should still match their
+# plain Latin counterpart (Ottoman Turkish transliterations in particular).
+FOLD_TABLE = str.maketrans({
+    'ı': 'i',
+    'ø': 'o',
+    'đ': 'd',
+    'ð': 'd',
+    'ł': 'l',
+    'æ': 'ae',
+    'œ': 'oe',
+    'þ': 'th',
+})
+
+
+def fold(text):
+    """Case-fold `text` and strip diacritics so that e.g. 'Şehir', 'sehir' and 'ŞEHİR' compare equal."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return text.translate(FOLD_TABLE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text))
+
+
+class SearchIndex:
+    """Incremental inverted index over the fields of every siteObject record.
+
+    Queries are whitespace-separated terms that must all match. Terms of at
+    least MIN_PREFIX_LENGTH characters are prefix matches, and a term can be
+    limited to one field with `field:term` (e.g. `author:macmichael
+    keywords:inscr`). Results are ranked by a tf-idf score in which exact token
+    matches weigh more than prefix matches.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._tokens = []
+        self._documents = {}
+        self._fields = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def update(self, filename, site_object):
+        """Index `site_object` under `filename`, replacing any previous version; None removes it."""
+        with self._lock:
+            self._remove(filename)
+            if site_object is not None:
+                self._add(filename, site_object)
+
+    def _add(self, filename, site_object):
+        terms = {}
+        for field, value in site_object.items():
+            if not value:
+                continue
+            self._fields.setdefault(field.lower(), field)
+            for token in tokenize(str(value)):
+                field_counts = terms.setdefault(token, {})
+                field_counts[field] = field_counts.get(field, 0) + 1
+        for token, field_counts in terms.items():
+            documents = self._postings.get(token)
+            if documents is None:
+                documents = self._postings[token] = {}
+                bisect.insort(self._tokens, token)
+            documents[filename] = field_counts
+        self._documents[filename] = list(terms)
+
+    def _remove(self, filename):
+        for token in self._documents.pop(filename, ()):
+            documents = self._postings[token]
+            del documents[filename]
+            if not documents:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def _expand(self, prefix):
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            if prefix in self._postings:
+                yield prefix
+            return
+        start = bisect.bisect_left(self._tokens, prefix)
+        for position in range(start, len(self._tokens)):
+            token = self._tokens[position]
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def _parse(self, query):
+        terms = []
+        for part in query.split():
+            field = None
+            if ':' in part:
+                name, part = part.split(':', 1)
+                field = self._fields.get(name.lower())
+                if field is None:
+                    # Unknown field names are searched as plain text.
+                    part = f"{name} {part}"
+            for token in tokenize(part):
+                terms.append((field, token))
+        return terms
+
+    def _score_term(self, field, prefix):
+        scores = {}
+        total = len(self._documents) or 1
+        for token in self._expand(prefix):
+            documents = self._postings[token]
+            idf = math.log(1 + total / len(documents))
+            weight = idf if token == prefix else idf / 2
+            for filename, field_counts in documents.items():
+                if field is None:
+                    count = sum(field_counts.values())
+                else:
+                    count = field_counts.get(field, 0)
+                    if not count:
+                        continue
+                scores[filename] = scores.get(filename, 0.0) + weight * (1 + math.log(count))
+        return scores
+
+    def search(self, query):
+        """Return the filenames matching every term of `query`, best match first."""
+        with self._lock:
+            terms = self._parse(query)
+            if not terms:
+                return []
+            # Score the most selective terms first so the intersection shrinks quickly.
+            term_scores = sorted((self._score_term(field, token) for field, token in terms), key=len)
+            scores = term_scores[0]
+            for other in term_scores[1:]:
+                if not scores:
+                    break
+                scores = {filename: score + other[filename] for filename, score in scores.items() if filename in other}
+        return sorted(scores, key=lambda filename: (-scores[filename], filename))
@@ -0,0 +1,327 @@
+"""Declarative description of a siteObject record.
+
+SCHEMA lists every element of the document in order, with the form field it
+comes from, its label, its type and whether it is required. It is compiled
+once, at import, into the tables used by the four paths that handle records:
+the MyForm class, parsing a submitted form, the XML layout written by
+site_xml.build_site_xml and the reader site_xml.read_site_values.
+"""
+import re
+from collections import namedtuple
+
+from spatial_index import validate_coordinates
+
+# Layout kinds: TEXT elements hold the value of a form field, GROUP elements
+# wrap a list of TEXT children, LANGUAGE elements repeat their value in an
+# xml:lang attribute and CATEGORIES is where the <desc type="category">
+# blocks go. FORM fields are submitted but not written to the document.
+TEXT = 'text'
+GROUP = 'group'
+LANGUAGE = 'language'
+CATEGORIES = 'categories'
+FORM = 'form'
+
+# Value types, used for validation and for the MyForm field classes.
+STRING = 'string'
+TEXTAREA = 'textarea'
+CHOICE = 'choice'
+COORDINATE = 'coordinate'
+
+# Characters XML 1.0 does not allow, such as the control characters that come
+# with text pasted from word processors.
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+Field = namedtuple('Field', 'kind tag name label type required choices children')
+
+
+def _field(kind, tag, label, name=None, type=STRING, required=False, choices=None):
+    return Field(kind, tag, name or tag, label, type, required, choices, None)
+
+
+def text(tag, label, **options):
+    return _field(TEXT, tag, label, **options)
+
+
+def choice(tag, label, choices, **options):
+    return _field(TEXT, tag, label, type=CHOICE, choices=choices, **options)
+
+
+def coordinate(tag, label, **options):
+    return _field(TEXT, tag, label, type=COORDINATE, **options)
+
+
+def language(tag, label, choices, **options):
+    return _field(LANGUAGE, tag, label, type=CHOICE, choices=choices, **options)
+
+
+def group(tag, children):
+    return Field(GROUP, tag, None, None, None, False, None, children)
+
+
+DATING_CRITERIA_CHOICES = [
+    ('lettering', 'Paleography of the document'),
+    ('nomenclature', 'Personal names and naming conventions for a specific period'),
+    ('prosopography', 'Mention of historically attested individuals'),
+    ('reign', 'Mention of officials with known periods of rule'),
+    ('titulature', 'Mention of imperial or other titles with known dates'),
+    ('internal-date', 'Explicit dating in the document'),
+    ('context', 'Archaeological or architectural context'),
+]
+
+AGE_CHOICES = [
+    ('prehistory', 'Prehistory'),
+    ('iron_age', 'Iron Age'),
+    ('roman_age', 'Roman Age'),
+    ('late_antiquity', 'Late Antiquity'),
+    ('middle_ages', 'Middle Ages'),
+    ('ottoman_period', 'Ottoman Period'),
+]
+
+CERTAINTY_CHOICES = [
+    ('high', 'High certainty'),
+    ('medium', 'Relative certainty'),
+    ('low', 'Low certainty'),
+]
+
+LANGUAGE_CHOICES = [
+    ('eng', 'English'), ('ara', 'Arabic'), ('bos', 'Bosnian'), ('bul', 'Bulgarian'),
+    ('ell', 'Modern Greek'), ('spa', 'Spanish'), ('ita', 'Italian'), ('lat', 'Latin'),
+    ('deu', 'German'), ('ota', 'Ottoman Turkish'), ('fas', 'Persian'), ('pol', 'Polish'),
+    ('ron', 'Romanian'), ('rus', 'Russian'), ('srp', 'Serbian'), ('grc', 'Ancient Greek'),
+    ('tur', 'Turkish'), ('hun', 'Hungarian'), ('fre', 'French'), ('hrv', 'Croatian'),
+    ('chu', 'Church Slavonic'),
+]
+
+# (category, label, subcategory form field, subcategory choices), as on the form.
+CATEGORY_CHOICES = [
+    ('communication', 'Communication', 'communication_subcategories[]', [
+        ('inn', 'Inn'), ('bridge', 'Bridge'), ('viaduct', 'Viaduct'), ('imaret', 'Imaret'),
+        ('ford', 'Ford'), ('quarantine', 'Quarantine'), ('postStation', 'Post Station'),
+        ('roadsideFountain', 'Roadside fountain'), ('oldRoadRemains', 'Old Road Remains'),
+    ]),
+    ('religious', 'Religious sites & objects', 'religious_subcategories[]', [
+        ('church', 'Church'), ('paganTemple', 'Pagan Temple'), ('chapel', 'Chapel'),
+        ('mosque', 'Mosque'), ('tekke', 'Tekke'), ('madrasah', 'Madrasah'), ('turbe', 'Türbe'),
+        ('ancientMausoleum', 'Ancient Mausoleum'), ('monastery', 'Monastery'), ('caveMonastery', 'Cave Monastery'),
+        ('votiveTablet', 'Votive Tablet'), ('votiveStone', 'Votive Stone'), ('megaliths', 'Megaliths'),
+        ('synagogue', 'Synagogue'),
+    ]),
+    ('inscriptions', 'Inscriptions', 'inscriptions_subcategories[]', [
+        ('funerary_inscription', 'Funerary Inscription'), ('boundary_inscription', 'Boundary Inscription'),
+        ('milestone', 'Milestone'), ('building_inscription', 'Building Inscription'),
+        ('dedicatory_inscription', 'Dedicatory Inscription'), ('honorary_inscription', 'Honorary Inscription'),
+        ('votive_inscription', 'Votive Inscription'), ('list', 'List'), ('legal_inscription', 'Legal Inscription'),
+    ]),
+    ('fortifications', 'Fortifications', 'fortifications_subcategories[]', [
+        ('fortress', 'Fortress'), ('quadriburgium', 'Quadriburgium'), ('palanka', 'Palanka'),
+        ('watchtower', 'Watchtower'), ('fort', 'Fort'),
+    ]),
+    ('settlements', 'Settlements', 'settlements_subcategories[]', [
+        ('settlement', 'Settlement'), ('town', 'Town'), ('village', 'Village'), ('villa', 'Villa'),
+        ('mahalla', 'Mahalla'), ('chiftlik', 'Chiftlik'), ('tell', 'Tell'), ('towerhouse', 'Towerhouse'),
+        ('building', 'Building'),
+    ]),
+    ('linear', 'Linear structures', 'linear_subcategories[]', [
+        ('dike', 'Dike'), ('moat', 'Moat'), ('stone_wall', 'Stone Wall'), ('gate', 'Gate'),
+    ]),
+    ('manuscripts', 'Manuscripts', 'manuscript_subcategories[]', [
+        ('decree', 'Decree'), ('book', 'Book'), ('scroll', 'Scroll'), ('royal_charter', 'Royal Charter'),
+    ]),
+    ('water', 'Water', 'water_subcategories[]', [
+        ('ancientBath', 'Ancient Bath'), ('hammam', 'Hammam'), ('aqueduct', 'Aqueduct'),
+        ('waterPipeline', 'Water Pipeline'), ('waterReservoir', 'Water Reservoir'), ('fountain', 'Fountain'),
+    ]),
+    ('economy', 'Economy', 'economy_subcategories[]', [
+        ('BazaarBedesten', 'Bazaar/Bedesten'), ('horreum', 'Horreum'), ('quarry', 'Quarry'), ('mine', 'Mine'),
+        ('slag_pile', 'Slag Pile'), ('bloomery', 'Bloomery'),
+        ('water_powered_trip_hammer', 'Water-Powered Trip Hammer'), ('customs', 'Customs'),
+    ]),
+    ('other', 'Other', 'other_subcategories[]', [
+        ('mound_of_indeterminate_function', 'Mound of Indeterminate Function'), ('rock_relief', 'Rock Relief'),
+        ('clock_tower', 'Clock Tower'), ('architectural_detail', 'Architectural Detail'),
+        ('sculpture', 'Sculpture'), ('stele', 'Stele'), ('spolia', 'Spolia'), ('coins', 'Coins'),
+        ('gem', 'Gem'), ('others', 'Others'),
+    ]),
+    ('burials', 'Burials', 'burials_subcategories[]', [
+        ('sarcophagus', 'Sarcophagus'), ('tombstone', 'Tombstone'), ('tumular_necropolis', 'Tumular Necropolis'),
+        ('flat_necropolis', 'Flat Necropolis'), ('cemetery', 'Cemetery'), ('dolmen', 'Dolmen'),
+        ('tumulus', 'Tumulus'),
+    ]),
+]
+
+SCHEMA = [
+    _field(FORM, 'filename', 'Filename', required=True),
+    text('author', 'Author', required=True),
+    text('nameSource', 'Name (according to source)', name='name_source', required=True),
+    text('nameContemporary', 'Name (contemporary)', name='name_contemporary', required=True),
+    text('description', 'Description', type=TEXTAREA),
+    text('provenanceOrigin', 'Provenance Origin', name='provenance_origin'),
+    group('geographicCoordinates', [
+        coordinate('latitude', 'Latitude', required=True),
+        coordinate('longitude', 'Longitude', required=True),
+    ]),
+    text('geonamesLink', 'Geonames Link'),
+    text('pleiadesLink', 'Pleiades Link'),
+    text('date', 'Date', required=True),
+    choice('datingCriteria', 'Dating Criteria', DATING_CRITERIA_CHOICES),
+    text('localizationSource', 'Localization Source'),
+    choice('localizationCertainity', 'Localization Certainty', CERTAINTY_CHOICES),
+    choice('age', 'Age (according to source)', AGE_CHOICES),
+    text('provenanceObservedIn', 'Provenance Observed In'),
+    group('geographicCoordinatesObserved', [
+        coordinate('latitudeObserved', 'Latitude Observed'),
+        coordinate('longitudeObserved', 'Longitude Observed'),
+    ]),
+    text('geonamesLinkObserved', 'Geonames Link Observed'),
+    text('pleiadesLinkObserved', 'Pleiades Link Observed'),
+    text('dateObserved', 'Date Observed'),
+    choice('datingCriteriaObserved', 'Dating Criteria Observed', DATING_CRITERIA_CHOICES),
+    text('provenanceOtherLocations', 'Provenance Other Locations'),
+    group('geographicCoordinatesOther', [
+        coordinate('latitudeOther', 'Latitude Other'),
+        coordinate('longitudeOther', 'Longitude Other'),
+    ]),
+    text('geonamesLinkOtherLocations', 'Geonames Link Other Locations'),
+    text('dateOtherLocations', 'Date Other Locations'),
+    choice('datingCriteriaOtherLocations', 'Dating Criteria Other Locations', DATING_CRITERIA_CHOICES),
+    text('currentLocation', 'Current Location'),
+    group('geographicCoordinatesCurrent', [
+        coordinate('latitudeCurrent', 'Latitude Current'),
+        coordinate('longitudeCurrent', 'Longitude Current'),
+    ]),
+    text('geonamesLinkCurrent', 'Geonames Link Current'),
+    text('pleiadesLinkCurrent', 'Pleiades Link Current'),
+    Field(CATEGORIES, 'desc', 'categories[]', 'Category', CHOICE, False, CATEGORY_CHOICES, None),
+    text('authorPublication', 'Author of Publications (as in Bibliography)'),
+    group('informationDates', [
+        text('startDate', 'Start Date'),
+        text('endDate', 'End Date'),
+    ]),
+    choice('ageContemporary', 'Age (contemporary)', AGE_CHOICES),
+    language('originalLanguage', 'Original Language', LANGUAGE_CHOICES, required=True),
+    language('publicationLanguage', 'Publication Language', LANGUAGE_CHOICES),
+    text('sourceInformation', 'Source Information/Bibliography', required=True),
+    text('annotation', 'Annotations', type=TEXTAREA),
+    text('keywords', 'Keywords', required=True),
+    text('sourceContent', 'Source Content', type=TEXTAREA),
+    text('copyrightStoragePlace', 'Copyright Storage Place'),
+    text('viaf', 'VIAF'),
+    text('iiif', 'IIIF'),
+]
+
+
+def _leaves(schema):
+    for field in schema:
+        if field.kind == GROUP:
+            yield from field.children
+        else:
+            yield field
+
+
+def _layout(schema):
+    return [
+        (field.kind, field.tag, _layout(field.children) if field.kind == GROUP else field.name)
+        for field in schema
+        if field.kind != FORM
+    ]
+
+
+# Compiled tables.
+SITE_OBJECT_SCHEMA = _layout(SCHEMA)
+FIELDS = [field for field in _leaves(SCHEMA) if field.kind != CATEGORIES]
+REQUIRED_FIELDS = [(field.name, field.label) for field in FIELDS if field.required]
+FIELD_CHOICES = {field.name: frozenset(value for value, _ in field.choices) for field in FIELDS if field.choices}
+FIELD_LABELS = {field.name: field.label for field in FIELDS}
+# Older records store language names instead of codes.
+LANGUAGE_CODES = {label: code for code, label in LANGUAGE_CHOICES}
+SUBCATEGORY_FIELDS = {category: form_field for category, _, form_field, _ in CATEGORY_CHOICES}
+SUBCATEGORY_CHOICES = {
+    category: frozenset(value for value, _ in subcategories)
+    for category, _, _, subcategories in CATEGORY_CHOICES
+}
+# Element tag -> (kind, form field) at the top level, and per group for its children.
+READ_TABLE = {field.tag: (field.kind, field.name) for field in SCHEMA if field.kind not in (GROUP, FORM)}
+READ_TABLE.update({
+    field.tag: (GROUP, {child.tag: child.name for child in field.children})
+    for field in SCHEMA
+    if field.kind == GROUP
+})
+
+
+def parse_form(form):
+    """Read a submitted form into build_site_xml's (values, categories) arguments.
+
+    `form` is a werkzeug MultiDict; single-valued fields are taken in one pass
+    and only the subcategory lists of the selected categories are looked up.
+    A known category always gets a (possibly empty) subcategory list.
+    """
+    values = form.to_dict()
+    categories = []
+    for category in form.getlist('categories[]'):
+        form_field = SUBCATEGORY_FIELDS.get(category)
+        categories.append((category, form.getlist(form_field) if form_field else None))
+    return values, categories
+
+
+def site_object_of(values):
+    """The flat tag -> text dict (as parse_site_object returns) of submitted form values."""
+    return {field.tag: values.get(field.name) for field in FIELDS}
+
+
+def validate_site_values(values, categories, required=True):
+    """Return every error in a record's (values, categories), not just the first.
+
+    Checks that no value holds a character XML cannot store, required
+    fields (unless `required` is false), that choice fields hold one of
+    their values, the categories and subcategories against the form's
+    vocabulary and the coordinate pairs.
+    """
+    errors = []
+    for name, label in FIELD_LABELS.items():
+        if INVALID_XML_CHARS.search(values.get(name) or ''):
+            errors.append(f"{label} contains a character that XML cannot store")
+    for category, subcategories in categories:
+        for value in [category, *(subcategories or ())]:
+            if INVALID_XML_CHARS.search(value):
+                errors.append(f"Category {value!r} contains a character that XML cannot store")
+    if required:
+        for name, label in REQUIRED_FIELDS:
+            if not (values.get(name) or '').strip():
+                errors.append(f"{label} is required")
+    for name, allowed in FIELD_CHOICES.items():
+        value = values.get(name)
+        if value and value not in allowed:
+            errors.append(f"{FIELD_LABELS[name]}: {value!r} is not one of the listed values")
+    for category, subcategories in categories:
+        allowed = SUBCATEGORY_CHOICES.get(category)
+        if allowed is None:
+            errors.append(f"Unknown category {category!r}")
+            continue
+        for subcategory in subcategories or ():
+            if subcategory not in allowed:
+                errors.append(f"Unknown subcategory {subcategory!r} of {category!r}")
+    errors.extend(validate_coordinates(values))
+    return errors
+
+
+def form_class(base):
+    """Build the WTForms form for SCHEMA on `base` (FlaskForm)."""
+    from wtforms import SelectField, SelectMultipleField, StringField, TextAreaField
+    from wtforms.validators import InputRequired, Optional
+
+    placeholder = [('', '--Please select from the list--')]
+    attributes = {}
+    for field in FIELDS:
+        validators = [InputRequired()] if field.required else [Optional()]
+        if field.type == CHOICE:
+            attributes[field.name] = SelectField(field.label, choices=placeholder + field.choices, validators=validators)
+        elif field.type == TEXTAREA:
+            attributes[field.name] = TextAreaField(field.label, validators=validators)
+        else:
+            attributes[field.name] = StringField(field.label, validators=validators)
+    attributes['categories'] = SelectMultipleField(
+        'Category', choices=[(category, label) for category, label, _, _ in CATEGORY_CHOICES]
+    )
+    for category, label, _, subcategories in CATEGORY_CHOICES:
+        attributes[f"{category}_subcategories"] = SelectMultipleField(f"{label} Subcategories", choices=subcategories)
+    return type('MyForm', (base,), attributes)
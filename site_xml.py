@@ -0,0 +1,148 @@
+import xml.etree.ElementTree as ET
+
+from site_schema import (
+    CATEGORIES,
+    GROUP,
+    INVALID_XML_CHARS,
+    LANGUAGE,
+    LANGUAGE_CODES,
+    READ_TABLE,
+    SITE_OBJECT_SCHEMA,
+    TEXT
+)
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+
+def parse_site_object(content):
+    """Parse a siteObject XML document into a flat tag -> text dict.
+
+    Grouping elements such as <geographicCoordinates> and <informationDates>
+    are flattened so their children (latitude, startDate, ...) become keys of
+    their own. The <desc type="category"> blocks are summarised as
+    space-separated 'category' and 'subcategory' values.
+    """
+    return flatten_site_object(ET.fromstring(content))
+
+
+def flatten_site_object(root):
+    site_object = {}
+    categories = []
+    subcategories = []
+    for child in root:
+        site_object[child.tag] = child.text
+        if child.tag == 'desc':
+            if child.get('type') == 'category':
+                list_element = child.find('list')
+                if list_element is not None:
+                    categories.append(list_element.get('type', ''))
+                    subcategories.extend(item.text.strip() for item in list_element.findall('item') if item.text)
+                elif child.text and child.text.strip():
+                    categories.append(child.text.strip())
+            continue
+        for grandchild in child:
+            site_object[grandchild.tag] = grandchild.text
+    site_object['category'] = ' '.join(categories) or None
+    site_object['subcategory'] = ' '.join(subcategories) or None
+    return site_object
+
+
+INDENT = '    '
+XML_DECLARATION = '<?xml version="1.0" ?>\n'
+def _escape(value):
+    # Same escaping as xml.dom.minidom, which wrote these files originally.
+    if INVALID_XML_CHARS.search(value):
+        raise ValueError(f"not well-formed (invalid character) in {value!r}")
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+
+def _escape_text(value):
+    # An XML parser folds CRLF and lone CR into LF, so the round trip through
+    # minidom did too.
+    return _escape(value.replace('\r\n', '\n').replace('\r', '\n'))
+
+
+def _write_text(out, indent, tag, value, attributes=''):
+    if value:
+        out.append(f"{indent}<{tag}{attributes}>{_escape_text(value)}</{tag}>\n")
+    else:
+        out.append(f"{indent}<{tag}{attributes}/>\n")
+
+
+def _write_categories(out, indent, categories):
+    inner = indent + INDENT
+    for category_name, subcategories in categories:
+        if subcategories is None:
+            _write_text(out, indent, 'desc', category_name, ' type="category"')
+            continue
+        out.append(f'{indent}<desc type="category">\n')
+        list_tag = f'list type="{_escape(category_name)}"'
+        if subcategories:
+            out.append(f"{inner}<{list_tag}>\n")
+            for subcategory in subcategories:
+                _write_text(out, inner + INDENT, 'item', subcategory)
+            out.append(f"{inner}</list>\n")
+        else:
+            out.append(f"{inner}<{list_tag}/>\n")
+        out.append(f"{indent}</desc>\n")
+
+
+def _write_elements(out, indent, schema, values, categories):
+    for kind, tag, source in schema:
+        if kind == TEXT:
+            _write_text(out, indent, tag, values.get(source))
+        elif kind == GROUP:
+            out.append(f"{indent}<{tag}>\n")
+            _write_elements(out, indent + INDENT, source, values, categories)
+            out.append(f"{indent}</{tag}>\n")
+        elif kind == LANGUAGE:
+            value = values.get(source) or ''
+            _write_text(out, indent, tag, value, f' xml:lang="{_escape(value)}"')
+        elif categories:
+            _write_categories(out, indent, categories)
+
+
+def build_site_xml(values, categories):
+    """Serialise a siteObject document in a single pass over SITE_OBJECT_SCHEMA.
+
+    `values` maps form field names to strings (missing or empty values become
+    empty elements) and `categories` is a list of (category, subcategories)
+    pairs, where subcategories is None for a category without a list. The
+    output is pretty-printed exactly as minidom's toprettyxml(indent='    ')
+    would.
+    """
+    out = [XML_DECLARATION, '<siteObject>\n']
+    _write_elements(out, INDENT, SITE_OBJECT_SCHEMA, values, categories)
+    out.append('</siteObject>\n')
+    return ''.join(out)
+
+
+def read_site_values(root):
+    """Read a parsed siteObject element back into build_site_xml's (values, categories) arguments.
+
+    One pass over the children using the compiled READ_TABLE. Languages are
+    read from xml:lang, or mapped from their name in older records.
+    """
+    values = {}
+    categories = []
+    for child in root:
+        kind, source = READ_TABLE.get(child.tag, (None, None))
+        if kind == GROUP:
+            for grandchild in child:
+                name = source.get(grandchild.tag)
+                if name is not None:
+                    values.setdefault(name, grandchild.text)
+        elif kind == LANGUAGE:
+            text = (child.text or '').strip()
+            values.setdefault(source, child.get(XML_LANG) or LANGUAGE_CODES.get(text, text) or None)
+        elif kind == CATEGORIES:
+            if child.get('type') != 'category':
+                continue
+            list_element = child.find('list')
+            if list_element is not None:
+                categories.append((list_element.get('type', ''), [item.text for item in list_element.findall('item')]))
+            elif child.text:
+                categories.append((child.text, None))
+        elif kind == TEXT:
+            values.setdefault(source, child.text)
+    return values, categories
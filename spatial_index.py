@@ -0,0 +1,150 @@
+import math
+import threading
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# (kind, latitude field, longitude field) for the four coordinate groups of a siteObject.
+COORDINATE_FIELDS = [
+    ('origin', 'latitude', 'longitude'),
+    ('observed', 'latitudeObserved', 'longitudeObserved'),
+    ('other', 'latitudeOther', 'longitudeOther'),
+    ('current', 'latitudeCurrent', 'longitudeCurrent'),
+]
+
+
+def parse_coordinate(value, limit):
+    """Parse a decimal degree string, accepting a decimal comma; raise ValueError if out of +-limit."""
+    number = float(value.strip().replace(',', '.'))
+    if not -limit <= number <= limit:
+        raise ValueError(f"{value} is outside -{limit}..{limit}")
+    return number
+
+
+def validate_coordinates(values):
+    """Return a list of error messages for the coordinate pairs in `values`.
+
+    A pair may be left empty, but if one half is given the other must be too.
+    """
+    errors = []
+    for kind, latitude_field, longitude_field in COORDINATE_FIELDS:
+        latitude = (values.get(latitude_field) or '').strip()
+        longitude = (values.get(longitude_field) or '').strip()
+        if not latitude and not longitude:
+            continue
+        if not latitude or not longitude:
+            errors.append(f"{latitude_field} and {longitude_field} must be given together")
+            continue
+        for field, value, limit in ((latitude_field, latitude, 90), (longitude_field, longitude, 180)):
+            try:
+                parse_coordinate(value, limit)
+            except ValueError:
+                errors.append(f"{field} must be a decimal number between -{limit} and {limit}, got {value!r}")
+    return errors
+
+
+def site_points(site_object):
+    """Yield (kind, latitude, longitude) for every valid coordinate pair of a record."""
+    for kind, latitude_field, longitude_field in COORDINATE_FIELDS:
+        latitude = site_object.get(latitude_field)
+        longitude = site_object.get(longitude_field)
+        if not latitude or not longitude:
+            continue
+        try:
+            yield kind, parse_coordinate(latitude, 90), parse_coordinate(longitude, 180)
+        except ValueError:
+            continue
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """Uniform grid over the coordinate pairs of every siteObject record.
+
+    Points are bucketed into `cell_size` degree cells, so a bounding box query
+    only looks at the cells it overlaps instead of every site.
+    """
+
+    def __init__(self, cell_size=0.25):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._points = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(points) for points in self._points.values())
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(longitude / self.cell_size), math.floor(latitude / self.cell_size))
+
+    def update(self, filename, site_object):
+        """Index the coordinates of `site_object` under `filename`; None removes them."""
+        with self._lock:
+            for cell, kind in self._points.pop(filename, ()):
+                points = self._cells[cell]
+                del points[(filename, kind)]
+                if not points:
+                    del self._cells[cell]
+            if site_object is None:
+                return
+            entries = []
+            for kind, latitude, longitude in site_points(site_object):
+                cell = self._cell(latitude, longitude)
+                self._cells.setdefault(cell, {})[(filename, kind)] = (latitude, longitude)
+                entries.append((cell, kind))
+            if entries:
+                self._points[filename] = entries
+
+    def _scan(self, min_lon, min_lat, max_lon, max_lat):
+        min_x, min_y = self._cell(min_lat, min_lon)
+        max_x, max_y = self._cell(max_lat, max_lon)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self._cells):
+            # Very large boxes: walking the occupied cells is cheaper than the grid.
+            cells = [cell for cell in self._cells if min_x <= cell[0] <= max_x and min_y <= cell[1] <= max_y]
+        else:
+            cells = [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+        for cell in cells:
+            for (filename, kind), (latitude, longitude) in self._cells.get(cell, {}).items():
+                if min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon:
+                    yield filename, kind, latitude, longitude
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Return (filename, kind, latitude, longitude) for every point inside the box.
+
+        A box with min_lon > max_lon wraps around the antimeridian.
+        """
+        with self._lock:
+            if min_lon > max_lon:
+                return list(self._scan(min_lon, min_lat, 180, max_lat)) + list(self._scan(-180, min_lat, max_lon, max_lat))
+            return list(self._scan(min_lon, min_lat, max_lon, max_lat))
+
+    def near(self, latitude, longitude, radius_km):
+        """Return (distance_km, filename, kind, latitude, longitude) within `radius_km`, nearest first."""
+        d_lat = radius_km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(latitude))
+        d_lon = 180 if cos_lat < 1e-6 else min(180, d_lat / cos_lat)
+        min_lat, max_lat = max(-90, latitude - d_lat), min(90, latitude + d_lat)
+        with self._lock:
+            if d_lon >= 180:
+                candidates = list(self._scan(-180, min_lat, 180, max_lat))
+            else:
+                min_lon, max_lon = longitude - d_lon, longitude + d_lon
+                candidates = list(self._scan(max(-180, min_lon), min_lat, min(180, max_lon), max_lat))
+                if min_lon < -180:
+                    candidates += self._scan(min_lon + 360, min_lat, 180, max_lat)
+                if max_lon > 180:
+                    candidates += self._scan(-180, min_lat, max_lon - 360, max_lat)
+        results = []
+        for filename, kind, point_latitude, point_longitude in candidates:
+            distance = haversine_km(latitude, longitude, point_latitude, point_longitude)
+            if distance <= radius_km:
+                results.append((distance, filename, kind, point_latitude, point_longitude))
+        results.sort()
+        return results
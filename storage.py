@@ -0,0 +1,118 @@
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Record names are hashed onto this many lock files, so the lock folder stays small.
+LOCK_SLOTS = 1024
+
+
+class _Slot:
+    def __init__(self):
+        # Threads of this process take turns on the RLock; only its outermost holder takes the flock.
+        self.lock = threading.RLock()
+        self.file = None
+        self.depth = 0
+
+
+_slots = {}
+_slots_guard = threading.Lock()
+
+
+def _reset_slots():
+    # A forked child must not inherit locks held by its parent's other threads.
+    global _slots_guard
+    _slots.clear()
+    _slots_guard = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_slots)
+
+
+def _slot_path(lock_folder, filename):
+    digest = hashlib.blake2b(filename.encode('utf-8'), digest_size=4).digest()
+    return os.path.join(lock_folder, f"{int.from_bytes(digest, 'big') % LOCK_SLOTS:04d}.lock")
+
+
+@contextmanager
+def file_lock(lock_folder, filename):
+    """Hold an exclusive advisory lock on `filename` across threads and processes.
+
+    Uses flock(2) so gunicorn workers serialise their writes to the same
+    record. Names are hashed onto LOCK_SLOTS lock files in `lock_folder`;
+    names that share a slot take turns. The lock is reentrant within a
+    thread, so a holder may also lock another name that shares its slot.
+    Where fcntl is unavailable only threads of the current process are
+    serialised.
+    """
+    path = _slot_path(lock_folder, filename)
+    with _slots_guard:
+        slot = _slots.get(path)
+        if slot is None:
+            slot = _slots[path] = _Slot()
+    with slot.lock:
+        if slot.depth == 0 and fcntl is not None:
+            os.makedirs(lock_folder, exist_ok=True)
+            slot.file = open(path, 'a')
+            fcntl.flock(slot.file, fcntl.LOCK_EX)
+        slot.depth += 1
+        try:
+            yield
+        finally:
+            slot.depth -= 1
+            if slot.depth == 0 and slot.file is not None:
+                fcntl.flock(slot.file, fcntl.LOCK_UN)
+                slot.file.close()
+                slot.file = None
+
+
+def content_digest(content):
+    """Hex digest identifying the exact bytes of a stored document, used as its ETag."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def atomic_write(path, data):
+    """Replace `path` with `data` (bytes) so readers see either the old or the new file, never a partial one."""
+    folder, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=folder or '.')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _fsync_folder(folder or '.')
+
+
+def _fsync_folder(folder):
+    # Make the rename itself durable; not supported on every platform.
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,414 @@
+"""Where the XML files of the upload folder are kept.
+
+FlatFolder keeps every file directly in the folder. ShardedFolder spreads
+them over two levels of hash-prefix subfolders (uploads/ab/cd/<name>.xml)
+and lists them in a manifest, so no directory grows huge and listing the
+records reads one file instead of walking the tree. Both offer the same
+methods to the record cache and the app.
+"""
+import hashlib
+import os
+import threading
+import time
+from urllib.parse import quote, unquote
+
+from storage import atomic_write, content_digest, file_lock
+
+MANIFEST_NAME = 'manifest.tsv'
+# Superseded manifest lines tolerated, beyond one per record, before it is rewritten.
+COMPACT_SLACK = 1024
+# Shard directories changed less than this long ago are listed again by the next check.
+RECENT_NS = 2 * 10**9
+
+
+def valid_name(filename):
+    """True for a plain file name that can be stored: no path separators, not hidden."""
+    return bool(filename) and not filename.startswith('.') and not any(
+        separator in filename for separator in ('/', '\\', '\0', os.sep)
+    )
+
+
+def shard_of(filename):
+    """The 'ab/cd' subfolder of `filename`, from a hash of its name."""
+    digest = hashlib.blake2b(filename.encode('utf-8'), digest_size=2).hexdigest()
+    return f"{digest[:2]}/{digest[2:]}"
+
+
+def _read_file(path):
+    # Content and stat of the same open file, so they always agree.
+    with open(path, 'rb') as xml_file:
+        return xml_file.read(), os.fstat(xml_file.fileno())
+
+
+class FlatFolder:
+    """Every file directly in `root`; a file's key is its (mtime, size, inode)."""
+
+    layout = 'flat'
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, filename):
+        return os.path.join(self.root, filename) if valid_name(filename) else None
+
+    def scan(self):
+        """Key of every stored file."""
+        keys = {}
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.xml') or not valid_name(entry.name) or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                keys[entry.name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return keys
+
+    def key(self, filename):
+        """Key of `filename`, or None if it is not stored."""
+        path = self.path(filename)
+        if path is None:
+            return None
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def exists(self, filename):
+        path = self.path(filename)
+        return path is not None and os.path.isfile(path)
+
+    def read(self, filename):
+        path = self.path(filename)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as xml_file:
+                return xml_file.read()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            return None
+
+    def write(self, filename, content):
+        """Replace `filename` with `content`; the caller holds the file's lock."""
+        path = self.path(filename)
+        if path is None:
+            raise ValueError(f"Invalid filename {filename!r}")
+        atomic_write(path, content)
+
+
+class Manifest:
+    """Name -> (shard, size, mtime_ns, digest) of every file of a sharded folder.
+
+    Kept in a text file of tab-separated 'name shard size mtime_ns digest'
+    lines; a line with just a name records a removal. Writers append under a
+    lock, so each process catches up by reading only what was appended since
+    it last looked. Once superseded lines outnumber the records by
+    COMPACT_SLACK, the file is rewritten and renamed into place, and readers
+    notice the new inode and read it afresh.
+    """
+
+    def __init__(self, path, lock_folder):
+        self.path = path
+        self.lock_folder = lock_folder
+        self.entries = {}
+        # Bumped whenever entries change, so readers can cache what they derive from them.
+        self.version = 0
+        self._inode = None
+        self._offset = 0
+        self._lines = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Read whatever other processes appended since the last call."""
+        with self._lock:
+            self._refresh()
+
+    def snapshot(self, version=None):
+        """Catch up and return (version, a copy of the entries); the copy is None while still at `version`."""
+        with self._lock:
+            self._refresh()
+            if self.version == version:
+                return version, None
+            return self.version, dict(self.entries)
+
+    def _refresh(self):
+        try:
+            manifest_file = open(self.path, 'rb')
+        except FileNotFoundError:
+            if self._inode is not None or self.entries:
+                self.entries, self._inode, self._offset, self._lines = {}, None, 0, 0
+                self.version += 1
+            return
+        with manifest_file:
+            st = os.fstat(manifest_file.fileno())
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                self.entries, self._inode, self._offset, self._lines = {}, st.st_ino, 0, 0
+                self.version += 1
+            manifest_file.seek(self._offset)
+            data = manifest_file.read()
+        # A line still being appended is left for the next call.
+        end = data.rfind(b'\n') + 1
+        if end:
+            self.version += 1
+        entries = self.entries
+        for line in data[:end].decode('utf-8').splitlines():
+            fields = line.split('\t')
+            name = unquote(fields[0])
+            if len(fields) == 5:
+                entries[name] = (fields[1], int(fields[2]), int(fields[3]), fields[4])
+            else:
+                entries.pop(name, None)
+            self._lines += 1
+        self._offset += end
+
+    def record(self, filename, shard, size, mtime_ns, digest):
+        self._append(f"{quote(filename, safe='')}\t{shard}\t{size}\t{mtime_ns}\t{digest}\n")
+
+    def remove(self, filename):
+        self._append(f"{quote(filename, safe='')}\n")
+
+    def _append(self, line):
+        with file_lock(self.lock_folder, MANIFEST_NAME), self._lock:
+            with open(self.path, 'ab') as manifest_file:
+                manifest_file.write(line.encode('utf-8'))
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+            # Reads this process's own line back along with any others.
+            self._refresh()
+            if self._lines > len(self.entries) + COMPACT_SLACK:
+                self._write(self.entries)
+
+    def replace(self, entries):
+        """Rewrite the manifest to hold exactly `entries`."""
+        with file_lock(self.lock_folder, MANIFEST_NAME), self._lock:
+            self._write(entries)
+
+    def _write(self, entries):
+        atomic_write(self.path, ''.join(
+            f"{quote(name, safe='')}\t{shard}\t{size}\t{mtime_ns}\t{digest}\n"
+            for name, (shard, size, mtime_ns, digest) in sorted(entries.items())
+        ).encode('utf-8'))
+        self._inode = None
+        self._refresh()
+
+
+class ShardedFolder:
+    """Files in hash-prefix shards of `root`, listed in its manifest.
+
+    A file's key is its (mtime, size, content digest) as the manifest records
+    them. XML files copied into the top level, by hand or by rsync, are moved
+    into their shard and added to the manifest the next time the folder is
+    scanned or the file is looked up; that is also how a flat folder is
+    converted in place.
+
+    Files added, replaced or deleted inside a shard without going through
+    the manifest are found by check_shards(), which scan() runs at most every
+    `check_interval` seconds.
+    """
+
+    layout = 'sharded'
+
+    def __init__(self, root, lock_folder, check_interval=30):
+        self.root = root
+        self.lock_folder = lock_folder
+        self.check_interval = check_interval
+        self.manifest = Manifest(os.path.join(root, MANIFEST_NAME), lock_folder)
+        self.manifest.refresh()
+        self._keys = (None, {})
+        # Shard -> directory mtime when it was last checked; None until the first check.
+        self._shard_mtimes = None
+        self._checked_at = 0.0
+
+    def path(self, filename):
+        if not valid_name(filename):
+            return None
+        return os.path.join(self.root, *shard_of(filename).split('/'), filename)
+
+    def scan(self):
+        """Key of every stored file, from the manifest.
+
+        Returns the same dict as the previous call while the manifest is unchanged.
+        """
+        self.adopt_all()
+        if self._shard_mtimes is None or time.monotonic() - self._checked_at >= self.check_interval:
+            self.check_shards()
+        known_version, keys = self._keys
+        # A copy, as another thread's append may change the manifest's entries meanwhile.
+        version, entries = self.manifest.snapshot(known_version)
+        if entries is not None:
+            keys = {
+                name: (mtime_ns, size, digest)
+                for name, (_, size, mtime_ns, digest) in entries.items()
+            }
+            self._keys = (version, keys)
+        return keys
+
+    def key(self, filename):
+        """Key of `filename`, or None if it is not stored.
+
+        The file is checked against its manifest entry, which is corrected if
+        the file was changed or removed without going through the manifest.
+        """
+        path = self.path(filename)
+        if path is None:
+            return None
+        self.adopt(filename)
+        entry = self._check(filename, path)
+        if entry is None:
+            # Possibly written or removed by another process a moment ago.
+            self.manifest.refresh()
+            entry = self._check(filename, path)
+        if entry is None:
+            self._correct(filename, path)
+            entry = self.manifest.entries.get(filename)
+        if entry is None:
+            return None
+        _, size, mtime_ns, digest = entry
+        return (mtime_ns, size, digest)
+
+    def _check(self, filename, path):
+        # The manifest entry, if it still describes the file on disk.
+        entry = self.manifest.entries.get(filename)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if entry is not None and (entry[1], entry[2]) == (st.st_size, st.st_mtime_ns):
+            return entry
+        return None
+
+    def _correct(self, filename, path):
+        # Under the file's lock, so it cannot be rewritten meanwhile, make its
+        # manifest entry describe the file in its shard; True if it had to change.
+        with file_lock(self.lock_folder, filename):
+            if self._check(filename, path) is not None:
+                return False
+            try:
+                content, st = _read_file(path)
+            except FileNotFoundError:
+                if filename not in self.manifest.entries:
+                    return False
+                self.manifest.remove(filename)
+                return True
+            self._record(filename, content, st)
+            return True
+
+    def _shards(self):
+        # (shard, path, directory mtime) of every shard directory.
+        with os.scandir(self.root) as firsts:
+            firsts = [first for first in firsts if len(first.name) == 2 and first.is_dir()]
+        for first in firsts:
+            with os.scandir(first.path) as seconds:
+                for second in seconds:
+                    if len(second.name) == 2 and second.is_dir():
+                        yield f"{first.name}/{second.name}", second.path, second.stat().st_mtime_ns
+
+    def check_shards(self):
+        """Correct the manifest for files changed inside shards outside the app; returns how many.
+
+        Only shards whose directory changed since the last check are listed,
+        so files added, deleted or replaced by a rename (as rsync and most
+        editors do) are found. A file rewritten in place leaves its directory
+        untouched and is corrected when it is next looked up. The first
+        check after start compares every shard.
+        """
+        self._checked_at = time.monotonic()
+        now_ns = time.time_ns()
+        known = self._shard_mtimes
+        mtimes = {}
+        changed = {}
+        for shard, path, mtime_ns in self._shards():
+            # A shard changed this recently may change again within the same
+            # timestamp tick, so it is not taken as checked yet.
+            mtimes[shard] = None if now_ns - mtime_ns < RECENT_NS else mtime_ns
+            if known is None or known.get(shard) != mtime_ns:
+                changed[shard] = path
+        # On the first check, or once a shard directory is gone, entries may name shards with no directory.
+        missing = known is None or any(shard not in mtimes for shard in known)
+        corrected = 0
+        if changed or missing:
+            _, entries = self.manifest.snapshot()
+            names = {}
+            for name, (shard, *_) in entries.items():
+                if shard in changed or (missing and shard not in mtimes):
+                    names.setdefault(shard, set()).add(name)
+            for shard, path in changed.items():
+                try:
+                    with os.scandir(path) as files:
+                        names.setdefault(shard, set()).update(
+                            entry.name for entry in files
+                            if entry.name.endswith('.xml') and valid_name(entry.name) and shard_of(entry.name) == shard
+                        )
+                except FileNotFoundError:
+                    continue  # removed meanwhile; its listed files are checked all the same
+            for shard_names in names.values():
+                for name in shard_names:
+                    path = self.path(name)
+                    if self._check(name, path) is None and self._correct(name, path):
+                        corrected += 1
+        self._shard_mtimes = mtimes
+        return corrected
+
+    def exists(self, filename):
+        path = self.path(filename)
+        return path is not None and (os.path.isfile(path) or os.path.isfile(os.path.join(self.root, filename)))
+
+    def read(self, filename):
+        path = self.path(filename)
+        if path is None:
+            return None
+        self.adopt(filename)
+        try:
+            with open(path, 'rb') as xml_file:
+                return xml_file.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, filename, content):
+        """Replace `filename` with `content`; the caller holds the file's lock."""
+        path = self.path(filename)
+        if path is None:
+            raise ValueError(f"Invalid filename {filename!r}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, content)
+        self._record(filename, content, os.stat(path))
+
+    def _record(self, filename, content, st):
+        self.manifest.record(filename, shard_of(filename), st.st_size, st.st_mtime_ns, content_digest(content))
+
+    def adopt(self, filename):
+        """Move a copy of `filename` in the top level into its shard; False if there is none."""
+        source = os.path.join(self.root, filename)
+        if not filename.endswith('.xml') or not valid_name(filename) or not os.path.isfile(source):
+            return False
+        # Under the file's lock, so an upload of the same name is not replaced by an older copy.
+        with file_lock(self.lock_folder, filename):
+            try:
+                content, st = _read_file(source)
+            except FileNotFoundError:
+                return False
+            target = self.path(filename)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+            self._record(filename, content, st)
+        return True
+
+    def adopt_all(self):
+        """Move every XML file in the top level into its shard; returns how many were moved."""
+        with os.scandir(self.root) as entries:
+            names = [entry.name for entry in entries if entry.name.endswith('.xml') and valid_name(entry.name) and entry.is_file()]
+        return sum(self.adopt(name) for name in names)
+
+    def rebuild_manifest(self):
+        """Rewrite the manifest from the files in the shards; returns how many there are."""
+        entries = {}
+        for shard, path, _ in self._shards():
+            with os.scandir(path) as files:
+                for entry in files:
+                    if entry.name.endswith('.xml') and entry.is_file() and shard_of(entry.name) == shard:
+                        content, st = _read_file(entry.path)
+                        entries[entry.name] = (shard, st.st_size, st.st_mtime_ns, content_digest(content))
+        self.manifest.replace(entries)
+        return len(entries)
@@ -0,0 +1,297 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# A file is complete once it is closed after writing or renamed into place
+# (rsync and atomic_write both write a temporary file and rename it).
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+# The folder itself went away, or the kernel dropped events: rescan everything.
+RESCAN_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None  # not Linux
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class Inotify:
+    """A non-blocking inotify descriptor watching one folder, through ctypes."""
+
+    def __init__(self, folder, mask=WATCH_MASK):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {folder}")
+
+    def fileno(self):
+        return self.fd
+
+    def read_events(self):
+        """(mask, name) of every queued event; name is '' for events on the folder itself."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _sweep(folder, suffix):
+    # name -> (mtime, size, inode) of every matching file.
+    snapshot = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix):
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        snapshot[entry.name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+                except FileNotFoundError:
+                    continue
+    return snapshot
+
+
+class FolderWatcher:
+    """Reports files of `folder` that are added, changed or removed outside the app.
+
+    On Linux changes are read from inotify; elsewhere, or if inotify cannot
+    be set up, the folder is swept with os.scandir every `poll_interval`
+    seconds and only files whose (mtime, size, inode) changed are reported.
+
+    Events are debounced: a file is reported once it has been quiet for
+    `debounce` seconds (or after `max_delay` while it keeps changing), and
+    all files due at the same time are passed to `apply(filenames)` in one
+    call. `apply(None)` asks for a full rescan: once at start, after an
+    inotify queue overflow, when the folder itself is replaced and, if
+    `rescan_interval` is set, every that many seconds, for changes in
+    subfolders, which are not watched.
+    """
+
+    def __init__(self, folder, apply, debounce=0.25, max_delay=2.0, poll_interval=5.0, suffix='.xml',
+                 rescan_interval=None):
+        self.folder = folder
+        self.apply = apply
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.suffix = suffix
+        self.rescan_interval = rescan_interval
+        self.backend = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = None
+        self._stopping = False
+        self._live = False
+        self._pending = {}
+        self._events = 0
+        self._applied = 0
+        self._rescans = 0
+        self._errors = 0
+
+    def start(self):
+        """Start the watcher thread; safe to call again, and after fork."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._live = False
+            self._pending = {}
+            self._wakeup = os.pipe()
+        self._thread = threading.Thread(target=self._run, name='upload-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._lock:
+            if self._pid != os.getpid() or self._stopping:
+                return
+            self._stopping = True
+        if self._thread.is_alive():
+            os.write(self._wakeup[1], b'\0')
+            self._thread.join(timeout)
+
+    def is_live(self):
+        """True once the initial rescan is done and changes are being followed in this process."""
+        return self._live and self._pid == os.getpid()
+
+    def status(self):
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'live': self.is_live(),
+                'pending': len(self._pending),
+                'events': self._events,
+                'applied': self._applied,
+                'rescans': self._rescans,
+                'errors': self._errors,
+            }
+
+    def _run(self):
+        inotify = None
+        try:
+            inotify = Inotify(self.folder)
+            self.backend = 'inotify'
+        except OSError as e:
+            logger.info("Watching %s by polling every %ss (%s)", self.folder, self.poll_interval, e)
+            self.backend = 'scandir'
+        snapshot = None
+        rescan = True
+        next_sweep = 0.0
+        next_rescan = float('inf')
+        try:
+            while True:
+                if rescan:
+                    rescan = False
+                    if inotify is None:
+                        snapshot = _sweep(self.folder, self.suffix)
+                        next_sweep = time.monotonic() + self.poll_interval
+                    # Until a rescan succeeds, requests keep scanning for themselves.
+                    self._live = self._dispatch(None)
+                    if self.rescan_interval:
+                        next_rescan = time.monotonic() + self.rescan_interval
+
+                now = time.monotonic()
+                if now >= next_rescan:
+                    rescan = True
+                    continue
+                timeout = min(self._next_due(now), next_rescan - now)
+                if inotify is None:
+                    timeout = min(timeout, max(0.0, next_sweep - now))
+                readable, _, _ = select.select(
+                    [self._wakeup[0]] + ([inotify] if inotify is not None else []), [], [], timeout
+                )
+                if self._wakeup[0] in readable:
+                    return
+
+                if inotify is not None:
+                    if inotify in readable:
+                        rescan = self._read_inotify(inotify)
+                        if rescan:
+                            # The rescan covers whatever was pending.
+                            inotify.close()
+                            inotify = None
+                            with self._lock:
+                                self._pending.clear()
+                            inotify = Inotify(self.folder)
+                elif time.monotonic() >= next_sweep:
+                    current = _sweep(self.folder, self.suffix)
+                    self._queue(
+                        [name for name, key in current.items() if snapshot.get(name) != key]
+                        + [name for name in snapshot if name not in current]
+                    )
+                    snapshot = current
+                    next_sweep = time.monotonic() + self.poll_interval
+
+                due = self._take_due(time.monotonic())
+                if due:
+                    self._dispatch(due)
+        except Exception:
+            logger.exception("Upload watcher stopped; falling back to scanning on request")
+        finally:
+            self._live = False
+            if inotify is not None:
+                inotify.close()
+            for fd in self._wakeup:
+                os.close(fd)
+
+    def _read_inotify(self, inotify):
+        # Queue the changed files; True if a full rescan is needed.
+        names = []
+        rescan = False
+        for mask, name in inotify.read_events():
+            if mask & RESCAN_MASK:
+                rescan = True
+            elif name.endswith(self.suffix):
+                names.append(name)
+        self._queue(names)
+        return rescan
+
+    def _queue(self, names):
+        now = time.monotonic()
+        with self._lock:
+            self._events += len(names)
+            for name in names:
+                first, _ = self._pending.get(name, (now, now))
+                self._pending[name] = (first, now)
+
+    def _next_due(self, now):
+        with self._lock:
+            if not self._pending:
+                return self.poll_interval
+            return max(0.0, min(
+                min(last + self.debounce, first + self.max_delay) - now
+                for first, last in self._pending.values()
+            ))
+
+    def _take_due(self, now):
+        with self._lock:
+            due = [
+                name for name, (first, last) in self._pending.items()
+                if now - last >= self.debounce or now - first >= self.max_delay
+            ]
+            for name in due:
+                del self._pending[name]
+        return due
+
+    def _dispatch(self, filenames):
+        try:
+            self.apply(filenames)
+        except Exception:
+            logger.exception("Applying upload changes failed")
+            with self._lock:
+                self._errors += 1
+            return False
+        with self._lock:
+            if filenames is None:
+                self._rescans += 1
+            else:
+                self._applied += len(filenames)
+        return True
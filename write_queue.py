@@ -0,0 +1,237 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.journal'
+
+
+def _read_journal(journal_file):
+    """Entries of a journal that were never marked done, in order."""
+    entries = {}
+    for line in journal_file:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # A torn last line from a crash mid-append.
+            continue
+        if record.get('op') == 'put':
+            entries[record['id']] = record
+        elif record.get('op') == 'done':
+            for entry_id in record['ids']:
+                entries.pop(entry_id, None)
+    return list(entries.values())
+
+
+class WriteBehindQueue:
+    """Durable queue of submissions written to storage by a background thread.
+
+    put() appends the entry to this process's journal in `folder`, fsyncs it
+    and returns; a writer thread then passes the entries to
+    `write(filename, values, categories)` in batches of up to `batch_size` and
+    marks them done in the journal, fsyncing the marker so a crash does not
+    replay entries already written. Concurrent put() calls share one fsync.
+    An entry whose write fails with anything but a ValueError (a record that
+    cannot be serialised) stays in the journal and is retried on the next start.
+
+    Each process holds a flock on its own journal, so journals left behind by
+    a process that crashed can be recognised and their outstanding entries are
+    replayed when the queue starts. A journal is truncated whenever the queue
+    runs empty.
+    """
+
+    def __init__(self, folder, write, batch_size=64):
+        self.folder = folder
+        self.write = write
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = deque()
+        self._writing = 0
+        # Filenames queued or being written by this process.
+        self._queued = Counter()
+        self._pid = None
+        self._journal = None
+        self._thread = None
+        self._stopping = False
+        self._next_id = 0
+        self._appended = 0
+        self._synced = 0
+        self._written = 0
+        self._failed = deque(maxlen=100)
+        self._failed_count = 0
+        self._stranded = 0
+        self._replayed = 0
+
+    def start(self):
+        """Open this process's journal, replay orphaned ones and start the writer; safe to call again after fork."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # After a fork the parent's journal and thread belong to the parent.
+            if self._journal is not None:
+                self._journal.close()
+            self._pid = os.getpid()
+            self._pending.clear()
+            self._queued.clear()
+            self._writing = 0
+            self._stranded = 0
+            self._stopping = False
+            os.makedirs(self.folder, exist_ok=True)
+            path = os.path.join(self.folder, f"{self._pid}-{time.time_ns()}{JOURNAL_SUFFIX}")
+            self._journal = open(path, 'ab', buffering=0)
+            if fcntl is not None:
+                fcntl.flock(self._journal, fcntl.LOCK_EX)
+        self._replay_orphans()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def _replay_orphans(self):
+        for path in sorted(glob.glob(os.path.join(self.folder, '*' + JOURNAL_SUFFIX))):
+            if path == self._journal.name:
+                continue
+            try:
+                orphan = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with orphan:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # its process is still running
+                if os.fstat(orphan.fileno()).st_nlink == 0:
+                    continue  # already replayed by another process
+                entries = _read_journal(orphan)
+                for entry in entries:
+                    self.put(entry['filename'], entry['values'], entry['categories'])
+                os.remove(path)
+            if entries:
+                logger.warning("Replayed %d unwritten submission(s) from %s", len(entries), path)
+                self._replayed += len(entries)
+
+    def put(self, filename, values, categories, overwrite=True):
+        """Durably enqueue a submission; it is written by the background thread.
+
+        With overwrite=False a filename that is still queued in this process
+        raises FileExistsError instead.
+        """
+        self.start()
+        with self._lock:
+            if not overwrite and self._queued[filename]:
+                raise FileExistsError(filename)
+            self._queued[filename] += 1
+            self._next_id += 1
+            entry = {
+                'op': 'put',
+                'id': self._next_id,
+                'filename': filename,
+                'values': values,
+                'categories': categories,
+                'queued_at': time.time(),
+            }
+            line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+            self._journal.write(line)
+            self._appended += len(line)
+            appended = self._appended
+            self._pending.append(entry)
+            self._wakeup.notify()
+        self._sync(appended)
+
+    def _sync(self, appended):
+        # Group commit: whoever gets the lock fsyncs everything appended so
+        # far, and callers whose entry is already covered return at once.
+        with self._sync_lock:
+            if self._synced >= appended:
+                return
+            with self._lock:
+                target = self._appended
+            os.fsync(self._journal.fileno())
+            self._synced = target
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._stopping:
+                    self._wakeup.wait()
+                if not self._pending:
+                    return
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                self._writing = len(batch)
+            done = []
+            for entry in batch:
+                try:
+                    self.write(entry['filename'], entry['values'], entry['categories'])
+                except Exception as e:
+                    logger.exception("Writing submission %s failed", entry['filename'])
+                    self._failed.append({'filename': entry['filename'], 'error': str(e), 'failed_at': time.time()})
+                    self._failed_count += 1
+                    if isinstance(e, ValueError):
+                        done.append(entry['id'])
+                    else:
+                        self._stranded += 1
+                else:
+                    self._written += 1
+                    done.append(entry['id'])
+            with self._lock:
+                if done:
+                    self._journal.write((json.dumps({'op': 'done', 'ids': done}) + '\n').encode('utf-8'))
+                for entry in batch:
+                    self._queued[entry['filename']] -= 1
+                    if not self._queued[entry['filename']]:
+                        del self._queued[entry['filename']]
+                self._writing = 0
+                if not self._pending and not self._stranded:
+                    # Everything is written; start the journal afresh.
+                    self._journal.truncate(0)
+                self._wakeup.notify_all()
+            if done:
+                # Replaying an entry that was already written could overwrite a newer upload.
+                os.fsync(self._journal.fileno())
+
+    def flush(self, timeout=None):
+        """Wait until every queued submission has been written; return False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._wakeup.wait(remaining)
+        return True
+
+    def stop(self, timeout=10):
+        """Write out what is queued and stop the writer thread."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._stopping = True
+            self._wakeup.notify_all()
+        self._thread.join(timeout)
+
+    def status(self):
+        with self._lock:
+            oldest = self._pending[0]['queued_at'] if self._pending else None
+            return {
+                'pending': len(self._pending) + self._writing,
+                'oldest_pending_seconds': round(time.time() - oldest, 3) if oldest else None,
+                'written': self._written,
+                'failed': self._failed_count,
+                'awaiting_retry': self._stranded,
+                'recent_failures': list(self._failed),
+                'replayed': self._replayed,
+                'journal': self._journal.name if self._journal else None,
+            }